@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Times spkg against fake package managers, so scan/search/install/update can be measured without touching the real ones.
+#   > python3 benchmark.py --sizes 10,1000,100000 --save baseline.json
+#   > python3 benchmark.py --sizes 10,1000,100000 --compare baseline.json
+
+
+import argparse
+import builtins
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+
+stubmanagers = ["apt", "apt-cache", "dpkg-query", "pacman", "flatpak", "npm", "pip", "conda", "cargo", "sudo"]
+
+stub = """#!{python}
+import json, os, sys, time
+
+name = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+
+if name == "sudo":
+    os.execvp(args[0], args)
+
+time.sleep(float(os.environ.get("SPKG_STUB_LATENCY", "0")))
+for hang in os.environ.get("SPKG_STUB_HANG", "").split(","):
+    if hang.split(":")[0] == name and (":" not in hang or hang.split(":")[1] in args):
+        time.sleep(float(os.environ.get("SPKG_STUB_HANG_SECONDS", "60")))
+
+size = int(os.environ.get("SPKG_STUB_PACKAGES", "100"))
+names = [f"{{name}}-package{{i}}" for i in range(size)]
+query = args[-1] if args else ""
+command = " ".join(args)
+
+if command in ("--version", "-version", "version"):
+    print(f"{{name}} 1.0.0")
+elif name == "dpkg-query":
+    print("\\n".join(f"{{package}}\\t1.0-{{i}}" for i, package in enumerate(names)))
+elif name == "apt-cache":
+    print("\\n\\n".join(f"Package: {{package}}\\nVersion: 1.0\\nDescription: Stub package {{package}}" for package in names))
+elif name == "pacman" and args[0] == "-Q":
+    print("\\n".join(f"{{package}} 1.0-{{i}}" for i, package in enumerate(names)))
+elif name == "pacman" and args[0] == "-Sl":
+    print("\\n".join(f"extra {{package}} 1.0-{{i}}" for i, package in enumerate(names)))
+elif name == "flatpak" and args[0] == "list":
+    print("\\n".join(f"org.stub.{{package}}\\t1.0" for package in names))
+elif name == "flatpak" and args[0] == "remote-ls":
+    print("\\n".join(f"org.stub.{{package}}\\t1.0\\tStub package" for package in names))
+elif name == "npm" and args[0] == "ls":
+    print(json.dumps({{"dependencies": {{package: {{"version": "1.0.0"}} for package in names}}}}))
+elif name in ("pip", "conda") and args[0] == "list":
+    print(json.dumps([{{"name": package, "version": "1.0"}} for package in names]))
+elif name == "cargo" and args[:2] == ["install", "--list"]:
+    print("\\n".join(f"{{package}} v1.0.0:\\n    {{package}}" for package in names))
+elif args and args[0] in ("search", "find", "-Ss"):
+    matches = [package for package in names if query in package]
+    print("\\n".join(f"{{package}}/stable 1.0 all\\n  Stub package {{package}}" for package in matches) or "No matches found")
+else:
+    print(f"{{name}} {{command}}")
+"""
+
+
+def makestubs(root: str):
+    os.makedirs(f"{root}/bin")
+    os.makedirs(f"{root}/home/spkg")
+
+    open(f"{root}/stub.py", "w").write(stub.format(python=sys.executable))
+    os.chmod(f"{root}/stub.py", 0o755)
+
+    for manager in stubmanagers:
+        os.symlink(f"{root}/stub.py", f"{root}/bin/{manager}")
+
+
+def loadspkg(root: str):
+    os.environ["HOME"] = f"{root}/home"
+    os.environ["APPDATA"] = f"{root}/home"
+    os.environ["PATH"] = f"{root}/bin"
+
+    spec = importlib.util.spec_from_file_location("spkg", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spkg.py"))
+    spkg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(spkg)
+
+    # Keep the host's own package databases out of the measurements
+    spkg.fingerprintpaths = {}
+    spkg.nativereaders = {}
+
+    return spkg
+
+
+def timed(function, repeat: int, answers: list[str]):
+    durations = []
+    stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+
+    for run in range(repeat):
+        pending = list(answers)
+        builtins.input = lambda prompt="": pending.pop(0) if pending else "n"
+
+        sys.stdout.flush()
+        os.dup2(devnull, 1)
+        start = time.perf_counter()
+        try:
+            function(run)
+        except SystemExit:
+            pass
+        finally:
+            sys.stdout.flush()
+            durations.append(time.perf_counter() - start)
+            os.dup2(stdout, 1)
+
+    os.close(devnull)
+    os.close(stdout)
+
+    return statistics.median(durations)
+
+
+def benchmark(size: int, arguments):
+    root = tempfile.mkdtemp(prefix="spkg-benchmark-")
+    makestubs(root)
+    spkg = loadspkg(root)
+
+    os.environ["SPKG_STUB_PACKAGES"] = str(size)
+    os.environ["SPKG_STUB_LATENCY"] = str(arguments.latency)
+    os.environ["SPKG_STUB_HANG"] = arguments.hang
+
+    spkg.probetimeout = arguments.timeout
+    spkg.searchtimeout = arguments.timeout
+    spkg.listtimeout = arguments.timeout
+    spkg.usecache = False
+
+    outputs = {manager: spkg.runcommand(spkg.listparsers[manager][0]).stdout for manager in ("apt", "pacman", "npm", "pip", "flatpak")}
+
+    results = {
+        "findmanagers": timed(lambda run: spkg.findmanagers(True), arguments.repeat, ["n", "n"]),
+        "searchpackage": timed(lambda run: spkg.searchpackage("package1"), arguments.repeat, []),
+        "getpackages": timed(lambda run: [spkg.getpackages(manager, outputs[manager]) for manager in outputs], arguments.repeat, []),
+        "installpackage": timed(lambda run: spkg.installpackage(f"package{run}"), arguments.repeat, ["1", "y"])
+    }
+
+    shutil.rmtree(root, ignore_errors=True)
+
+    return {f"{name}[{size}]": duration for name, duration in results.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks spkg against stub package managers")
+    parser.add_argument("--sizes", default="10,1000,100000", help="comma separated amounts of packages every stub reports")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every stub call sleeps before answering")
+    parser.add_argument("--hang", default="", help="comma separated stubs that never answer, e.g. conda,npm:search to only hang npm's searches")
+    parser.add_argument("--timeout", type=float, default=2.0, help="probe and search timeout given to spkg")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the median is reported")
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="fail if any result is slower than this JSON baseline allows")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, 0.25 = 25%%")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="slowdowns smaller than this many seconds are never counted as regressions")
+    arguments = parser.parse_args()
+
+    results = {}
+    for size in [int(size) for size in arguments.sizes.split(",")]:
+        results.update(benchmark(size, arguments))
+
+    baseline = json.loads(open(arguments.compare, "r").read()) if arguments.compare else {}
+    regressions = []
+
+    print(f"\033[1m{'Benchmark':<28}{'Seconds':>10}{'Baseline':>10}\033[0m")
+    for name, duration in results.items():
+        if name in baseline:
+            slower = duration > baseline[name] * (1 + arguments.tolerance) and duration - baseline[name] > arguments.min_delta
+            print(f"{name:<28}{duration:>10.4f}{baseline[name]:>10.4f}" + {True: "  \033[31;1mRegressed\033[0m", False: ""}[slower])
+            if slower:
+                regressions.append(name)
+        else:
+            print(f"{name:<28}{duration:>10.4f}")
+
+    if arguments.save:
+        open(arguments.save, "w").write(json.dumps(results, indent=True))
+
+    if regressions:
+        print(f"\033[31;1mError:\033[0m {len(regressions)} benchmarks regressed by more than {arguments.tolerance:.0%}")
+        sys.exit(1)
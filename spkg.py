@@ -4,58 +4,1225 @@
 
 
 import subprocess as sub
+import atexit
+import csv
+import gzip
+import hashlib
+import heapq
 import json
+import mmap
 import os
+import re
+import shlex
+import shutil
+import signal
+import site
+import socket
+import socketserver
+import sqlite3
+import struct
 import sys
+import sysconfig
+import tempfile
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+
+
+probeworkers = 8    # How many package manager probes may run at the same time
+probetimeout = 15   # Seconds before a probe is given up on and the manager counted as missing
+listtimeout = 300   # Seconds a package manager gets to list its installed packages during a scan
+searchworkers = 8   # How many package managers are searched at the same time (--jobs)
+searchtimeout = 30  # Seconds each package manager gets to answer a search (--timeout)
+usecache = True     # Whether search results may be answered from searchcache.json (--no-cache)
+cachettl = 3600     # Seconds a cached search result stays valid (--cache-ttl)
+cachesize = 512     # How many (manager, query) results the search cache keeps before evicting the least recently used (--cache-size)
+indexttl = 86400    # Seconds before a manager's part of the package index counts as stale and gets searched live again (--index-ttl)
+indextimeout = 600  # Seconds a bulk listing for the package index may take
+searchmode = "text" # How the package index is matched: "exact", "prefix" or "text" (--exact, --prefix)
+updateworkers = 4   # How many package managers may update at the same time (--jobs)
+tracing = False     # Whether every command and file access is recorded and written out as a trace at exit (--trace)
+metricsfile = None  # node_exporter textfile collector file (.prom) written after scan, search, install and update (--metrics)
+daemoninterval = 300 # Seconds between the daemon's scheduled reloads of managers.json and the inventory (--interval)
+indaemon = False    # Set inside the daemon itself, so it never tries to ask itself
+searchlimit = 10    # How many of the best matching packages a search shows (--limit)
+searchjson = False  # Whether search prints its results as JSON instead of a table (--json)
+binaryinventory = True # Whether inventory.bin is kept next to inventory.db, so lookups can binary search it without starting SQLite
+cachedrecords = 50  # How many of the best matching packages of every search are kept in the search cache
+snapshotkeyframe = 16 # Every how many scans a snapshot stores the full inventory instead of the changes since the previous one
+# Download-only variants of the update commands, so "update --prefetch" can download everything at once before installing
+prefetchcommands = {
+    "apt": "sudo apt-get update && sudo apt-get -d -y upgrade",
+    "dnf": "sudo dnf upgrade -y --downloadonly",
+    "pacman": "sudo pacman -Syuw --noconfirm",
+    "flatpak": "flatpak update -y --no-deploy",
+    "zypper": "sudo zypper --non-interactive update --download-only",
+    "homebrew": "brew outdated --formula -q | xargs brew fetch",
+    "brewcask": "brew outdated --cask -q | xargs brew fetch --cask",
+    "conda": "conda update --all -y --download-only"
+}
+outdatedttl = 3600  # Seconds a package manager's list of pending upgrades stays valid, unless its package database changes
+fleetworkers = 16   # How many hosts "spkg fleet scan" talks to at the same time (--jobs)
+fleettimeout = 600  # Seconds every host gets to scan and send its inventory (--timeout)
+fleetcommand = "ssh -o BatchMode=yes {host} {command}" # How a command is run on a host (--remote), {host} and {command} are filled in shell quoted
+batchsize = 200     # How many names a bulk lookup of search --batch passes to one call before starting another
+
+# Package managers in the same group share a lock or write to the same root filesystem, so only one of them updates at a time
+updategroups = [
+    ["apt", "dnf", "zypper", "pacman", "portage", "slackpkg", "espm"],
+    ["homebrew", "brewcask"]
+]
+
+# Package managers that have to finish updating before another one starts
+updatedependencies = {
+    "brewcask": ["homebrew"]
+}
+
+
+def spkgpath(filename: str):
+    if os.name == "nt":
+        return f"{os.getenv("APPDATA")}/spkg/{filename}"
+    return f"{os.path.expanduser('~')}/spkg/{filename}"
+
+
+traceevents = []
+tracestart = time.perf_counter()
+tracelock = threading.Lock()
+metriccounters = {}
+cachelock = threading.Lock()   # Serializes the read-modify-write of searchcache.json between the daemon's threads
+rankinglock = threading.Lock() # Same for ranking.json
+umask = os.umask(0)
+os.umask(umask) # Read once at startup, since writeatomic's temporary files would otherwise only be readable by their owner
+
+
+@contextmanager
+def tracespan(name: str, category: str, **details):
+    start = time.perf_counter()
+    try:
+        yield details
+    finally:
+        if tracing or (metricsfile and category == "command"):
+            with tracelock:
+                traceevents.append({
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - tracestart) * 1000000,
+                    "dur": (time.perf_counter() - start) * 1000000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": details
+                })
+
+
+def writetrace():
+    events = list(traceevents)
+    path = spkgpath(f"traces/trace-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    writeatomic(path, json.dumps({"traceEvents": events}))
+
+    summary = {}
+    for event in events:
+        key = (event["cat"], event["name"])
+        calls, total, longest, exitcodes = summary.get(key, (0, 0, 0, set()))
+        if "exitcode" in event["args"]:
+            exitcodes.add(str(event["args"]["exitcode"]))
+        summary[key] = (calls + 1, total + event["dur"] / 1000000, max(longest, event["dur"] / 1000000), exitcodes)
+
+    print(f"\n\033[1m{'Category':<10}{'Label':<40}{'Calls':>6}{'Total':>10}{'Longest':>10}  Exit codes\033[0m")
+    for (category, name), (calls, total, longest, exitcodes) in sorted(summary.items(), key=lambda item: -item[1][1]):
+        print(f"{category:<10}{name[:39]:<40}{calls:>6}{total:>9.3f}s{longest:>9.3f}s  {", ".join(sorted(exitcodes))}")
+    print(f"Trace written to \033[1m{path}\033[0m (open it in chrome://tracing or ui.perfetto.dev)")
+
+
+def countmetric(name: str, amount: int = 1):
+    with tracelock:
+        metriccounters[name] = metriccounters.get(name, 0) + amount
+
+
+def metricname(command: str):
+    # The package manager and its subcommand, without package names, so every command gets one time series
+    words = [word for word in command.split() if word != "sudo"]
+    return " ".join(words[:2])
+
+
+def writemetrics(command: str):
+    try:
+        state = readjson(spkgpath("metrics.json"))
+    except (FileNotFoundError, ValueError):
+        state = {"commands": {}, "counters": {}, "runs": {}}
 
+    with tracelock:
+        events = [event for event in traceevents if event["cat"] == "command" and event["args"].get("exitcode") != "cancelled"]
+        counters = dict(metriccounters)
 
-def getpackages(package_manager, output):
-    native_json_managers = {
-        "dnf", "pacman", "flatpak", "snap", "homebrew", "winget", "chocolatey", "scoop",
-        "npm", "pip", "gem", "conda", "yarn", "composer", "spack", "guix", "zypper"
-    }
+    durations = {}
+    for event in events:
+        name = metricname(event["args"]["command"])
+        durations[name] = durations.get(name, 0) + event["dur"] / 1000000
+        exitcode = event["args"].get("exitcode")
+        state["commands"][name] = {"seconds": durations[name], "exitcode": -1 if exitcode in (None, "timeout") else exitcode, "time": time.time()}
+
+    for name, amount in counters.items():
+        state["counters"][name] = state["counters"].get(name, 0) + amount
+    state["runs"][command] = time.time()
+    if counters.get("scans"):
+        state["lastscan"] = time.time()
+
+    writeatomic(spkgpath("metrics.json"), json.dumps(state))
+
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    lines = []
+
+    def metric(name: str, kind: str, description: str, samples: list):
+        lines.extend([f"# HELP spkg_{name} {description}", f"# TYPE spkg_{name} {kind}"])
+        for labels, value in samples:
+            lines.append(f"spkg_{name}" + ("{" + ",".join(f'{key}="{label(text)}"' for key, text in labels.items()) + "}" if labels else "") + f" {value}")
+
+    try:
+        detected = readjson(spkgpath("managers.json"))["packages"]
+    except (FileNotFoundError, ValueError):
+        detected = {}
+
+    inventory = openinventory()
+    amounts = inventory.execute("SELECT manager, COUNT(*) FROM installed GROUP BY manager ORDER BY manager").fetchall()
+    inventory.close()
+
+    hits = state["counters"].get("search_cache_hits", 0) + state["counters"].get("search_index_answers", 0) + state["counters"].get("search_daemon_answers", 0)
+    lookups = hits + state["counters"].get("search_cache_misses", 0)
+
+    metric("packages", "gauge", "Installed packages per package manager.", [({"manager": manager}, amount) for manager, amount in amounts])
+    metric("manager_detected", "gauge", "Whether the package manager was found on the last scan.", [({"manager": manager}, int(found)) for manager, found in detected.items()])
+    metric("command_duration_seconds", "gauge", "Seconds spent in a package manager command during the last spkg run that used it.", [({"command": name}, round(entry["seconds"], 6)) for name, entry in sorted(state["commands"].items())])
+    metric("command_exit_code", "gauge", "Exit code of the last call of a package manager command, -1 when it timed out.", [({"command": name}, entry["exitcode"]) for name, entry in sorted(state["commands"].items())])
+    metric("command_last_run_timestamp_seconds", "gauge", "When a package manager command last ran.", [({"command": name}, round(entry["time"], 3)) for name, entry in sorted(state["commands"].items())])
+    metric("search_lookups_total", "counter", "Search answers by where they came from.", [({"source": source}, state["counters"].get(key, 0)) for source, key in [("cache", "search_cache_hits"), ("index", "search_index_answers"), ("daemon", "search_daemon_answers"), ("live", "search_cache_misses")]])
+    metric("search_cache_hit_ratio", "gauge", "Share of search answers that didn't have to ask a package manager.", [({}, round(hits / lookups, 6) if lookups else 0)])
+    metric("run_timestamp_seconds", "gauge", "When an spkg command last finished.", [({"command": name}, round(finished, 3)) for name, finished in sorted(state["runs"].items())])
+    if "lastscan" in state:
+        metric("last_scan_timestamp_seconds", "gauge", "When the last successful scan finished.", [({}, round(state["lastscan"], 3))])
+
+    writeatomic(os.path.abspath(metricsfile), "\n".join(lines) + "\n")
+
+
+def readjson(path: str):
+    with tracespan(os.path.basename(path), "file", operation="load") as details:
+        content = open(path, "r").read()
+        details["bytes"] = len(content)
+        return json.loads(content)
+
+
+def writeatomic(path: str, content: str | bytes):
+    with tracespan(os.path.basename(path), "file", operation="dump", bytes=len(content)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A temporary file of its own per write, so threads of the daemon writing the same file never share one
+        descriptor, temp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(descriptor, {True: "wb", False: "w"}[isinstance(content, bytes)]) as file:
+                file.write(content)
+            os.chmod(temp, 0o666 & ~umask)
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+
+def loadsearchcache():
+    try:
+        return readjson(spkgpath("searchcache.json"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def savesearchcache(cache: dict):
+    while len(cache) > cachesize:
+        del cache[next(iter(cache))]
+
+    writeatomic(spkgpath("searchcache.json"), json.dumps(cache))
+
+
+def updatesearchcache(entries: dict):
+    # Merges into what's on disk now rather than what was read before searching, so concurrent searches keep each other's results
+    with cachelock:
+        cache = loadsearchcache()
+        for key, entry in entries.items():
+            cache.pop(key, None)
+            cache[key] = entry # Most recently used last
+        savesearchcache(cache)
+
+
+def openinventory():
+    os.makedirs(os.path.dirname(spkgpath("inventory.db")), exist_ok=True)
+    inventory = sqlite3.connect(spkgpath("inventory.db"), timeout=30, isolation_level="IMMEDIATE")
+    inventory.execute("PRAGMA journal_mode=WAL")
+
+    # sqlite3 only begins transactions before INSERT, UPDATE and DELETE, so every migration takes the write lock itself before
+    # checking the version again. Otherwise SPKGs started at the same time would all run it
+    if inventory.execute("PRAGMA user_version").fetchone()[0] == 0:
+        with inventory:
+            inventory.execute("BEGIN IMMEDIATE")
+            inventory.execute("CREATE TABLE IF NOT EXISTS installed (name TEXT PRIMARY KEY, manager TEXT NOT NULL)")
+
+            if inventory.execute("PRAGMA user_version").fetchone()[0] == 0:
+                try:
+                    # Carry over installed.json from before the inventory moved to SQLite
+                    legacy = readjson(spkgpath("installed.json"))
+                    inventory.executemany("INSERT OR REPLACE INTO installed (name, manager) VALUES (?, ?)", legacy.items())
+                except (FileNotFoundError, ValueError):
+                    pass
+
+                inventory.execute("PRAGMA user_version = 1")
+
+    if inventory.execute("PRAGMA user_version").fetchone()[0] == 1:
+        with inventory:
+            inventory.execute("BEGIN IMMEDIATE")
+            if inventory.execute("PRAGMA user_version").fetchone()[0] == 1:
+                inventory.execute("ALTER TABLE installed ADD COLUMN version TEXT")
+                inventory.execute("PRAGMA user_version = 2")
+
+    if inventory.execute("PRAGMA user_version").fetchone()[0] == 2:
+        with inventory:
+            inventory.execute("BEGIN IMMEDIATE")
+            if inventory.execute("PRAGMA user_version").fetchone()[0] == 2:
+                # Which package managers' packages the inventory holds, and the package database they were listed from
+                inventory.execute("CREATE TABLE listed (manager TEXT PRIMARY KEY, fingerprint TEXT, time REAL)")
+                inventory.execute("INSERT INTO listed SELECT DISTINCT manager, 'null', 0 FROM installed")
+                inventory.execute("PRAGMA user_version = 3")
+
+    if inventory.execute("PRAGMA user_version").fetchone()[0] == 3:
+        with inventory:
+            inventory.execute("BEGIN IMMEDIATE")
+            if inventory.execute("PRAGMA user_version").fetchone()[0] == 3:
+                # Counts the write transactions, inventory.bin is only trusted while it was built at the current count
+                inventory.execute("CREATE TABLE changes (count INTEGER NOT NULL)")
+                inventory.execute("INSERT INTO changes VALUES (0)")
+                inventory.execute("PRAGMA user_version = 4")
+
+    return inventory
+
+
+# inventory.bin: header, manager names, fixed size entries sorted by name, then a pool of interned name and version strings
+inventorymagic = b"SPKGINV\x03"
+inventoryheader = struct.Struct("<8sHIQ")    # magic, manager count, package count, inventory.db change count it was built at
+inventoryentry = struct.Struct("<IHIHB")     # name offset, name length, version offset, version length, manager id
+
+
+def packinventory(records: list[tuple], changes: int = 0):
+    managers = sorted({record[2] for record in records})
+    ids = {manager: n for n, manager in enumerate(managers)}
+
+    pool = bytearray()
+    interned = {}
+
+    def intern(text: str):
+        data = (text or "").encode()
+        if data not in interned:
+            interned[data] = len(pool)
+            pool.extend(data)
+        return interned[data], len(data)
+
+    entries = bytearray()
+    for name, packageversion, manager in sorted(records, key=lambda record: record[0].encode()):
+        entries += inventoryentry.pack(*intern(name), *intern(packageversion), ids[manager])
+
+    header = inventoryheader.pack(inventorymagic, len(managers), len(records), changes) + b"".join(bytes([len(manager)]) + manager.encode() for manager in managers)
+    return header + bytes(entries) + bytes(pool)
+
+
+def unpackheader(data):
+    magic, managercount, count, changes = inventoryheader.unpack_from(data, 0)
+    if magic != inventorymagic:
+        raise ValueError("not an SPKG inventory")
+
+    managers = []
+    position = inventoryheader.size
+    for n in range(managercount):
+        managers.append(bytes(data[position + 1:position + 1 + data[position]]).decode())
+        position += 1 + data[position]
+
+    return managers, count, position, position + count * inventoryentry.size, changes
+
+
+def unpackinventory(data):
+    managers, count, entries, pool, changes = unpackheader(data)
+
+    records = []
+    for n in range(count):
+        nameoffset, namelength, versionoffset, versionlength, manager = inventoryentry.unpack_from(data, entries + n * inventoryentry.size)
+        records.append((bytes(data[pool + nameoffset:pool + nameoffset + namelength]).decode(), bytes(data[pool + versionoffset:pool + versionoffset + versionlength]).decode(), managers[manager]))
+
+    return records
+
+
+def lookupinventory(path: str, package: str, changes: int | None = None):
+    # Gives the manager of a package from inventory.bin by binary search over the memory mapped file, only touching the pages it needs
+    key = package.encode()
+
+    with tracespan(os.path.basename(path), "file", operation="lookup"):
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            managers, count, entries, pool, built = unpackheader(data)
+            if changes is not None and built != changes:
+                raise ValueError("inventory.bin is older than inventory.db")
+
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                nameoffset, namelength, versionoffset, versionlength, manager = inventoryentry.unpack_from(data, entries + middle * inventoryentry.size)
+                name = data[pool + nameoffset:pool + nameoffset + namelength]
+
+                if name == key:
+                    return managers[manager]
+                if name < key:
+                    low = middle + 1
+                else:
+                    high = middle
+
+    return None
+
+
+def writenames(filename: str, names):
+    # One name per line sorted by their bytes, for the binary search of completionhelper. Only rewritten when whole package
+    # lists are written, so completions miss single installs and removals until the next listing
+    writeatomic(spkgpath(filename), "".join(name + "\n" for name in sorted(set(names), key=str.encode)).encode())
 
-    packages = set()
 
+def inventorychanges():
+    # A read only connection that skips openinventory's setup, None for an inventory without the count (missing or not migrated)
     try:
-        if package_manager in native_json_managers:
-            data = json.loads(output)
-            if isinstance(data, list):
-                for item in data:
-                    if "name" in item:
-                        package_name = item["name"]
-                        package_name = package_name.split("/")[0]
-                        packages.add(package_name)
-            elif isinstance(data, dict):
-                for package in data.keys():
-                    package_name = package.split("/")[0]
-                    packages.add(package_name)
+        inventory = sqlite3.connect(f"file:{spkgpath("inventory.db")}?mode=ro", uri=True, timeout=30)
+        try:
+            return inventory.execute("SELECT count FROM changes").fetchone()[0]
+        finally:
+            inventory.close()
+    except sqlite3.Error:
+        return None
+
+
+def countinventorychange(inventory):
+    # Part of every write transaction, so the count commits and rolls back together with the rows
+    inventory.execute("UPDATE changes SET count = count + 1")
+    return inventory.execute("SELECT count FROM changes").fetchone()[0]
+
+
+def writeinventorybin(records: list[tuple], changes: int):
+    # inventory.bin is only a cache rebuilt after bulk writes have committed, single installs and removals just count a change so
+    # lookups fall back to SQLite. Written after the commit, a crash or a rolled back write can only leave it looking stale
+    if binaryinventory:
+        writeatomic(spkgpath("inventory.bin"), packinventory(records, changes))
+
+
+def convertinventory(source: str, target: str):
+    if open(source, "rb").read(len(inventorymagic)) != inventorymagic:
+        content = readjson(source)
+        if "packages" in content and isinstance(content["packages"], list): # A lockfile from "spkg export"
+            records = [(package["name"], package.get("version", ""), package["manager"]) for package in content["packages"]]
         else:
-            for line in output.strip().splitlines():
-                line = line.strip()
-                if not line or line.startswith("Listing") or line.startswith("Done"):
-                    continue
-                columns = line.split()
-                if columns:
-                    package_name = columns[0].split("/")[0]
-                    packages.add(package_name)
+            records = [(name, "", manager) for name, manager in content.items()]
+    else:
+        records = unpackinventory(open(source, "rb").read())
 
-    except Exception as e:
-        if os.name == "posix":
-            managers = open(f"{os.path.expanduser('~')}/spkg/managers.json", "r").read()
-        elif os.name == "nt":
-            managers = open(f"{os.getenv("APPDATA")}/spkg/managers.json", "r").read()
-        
-        if str(e).startswith("Expecting value:"):
-            return {} # Package manager either isn't installed or hasn't been used to install anything yet
-        
+    if target.endswith(".bin"):
+        writeatomic(os.path.abspath(target), packinventory(records))
+    else:
+        writeatomic(os.path.abspath(target), json.dumps({name: manager for name, packageversion, manager in records}, indent=True))
+
+    print(f"Converted \033[1m{len(records)} packages\033[0m from \033[1m{source}\033[0m to \033[1m{target}\033[0m")
+
+
+def inventoryget(package: str, managers: list[str] | None = None):
+    # Lists the given package managers (all detected ones by default) first if the package isn't known yet
+    answer = daemonrequest({"op": "inventory", "package": package})
+    if answer is not None:
+        return answer["manager"]
+
+    for attempt in range(2):
+        row = False
+        changes = inventorychanges() if binaryinventory else None
+        if changes is not None:
+            try:
+                found = lookupinventory(spkgpath("inventory.bin"), package, changes)
+                row = None if found is None else (found,)
+            except (OSError, ValueError, struct.error):
+                pass # Missing, from an older SPKG or stale since the last install or removal, so SQLite has to answer
+
+        if row is False:
+            with tracespan("inventory.db", "file", operation="get"):
+                inventory = openinventory()
+                row = inventory.execute("SELECT manager FROM installed WHERE name = ?", [package]).fetchone()
+                inventory.close()
+
+        if row is not None or attempt == 1 or not ensureinventory(detectedmanagers() if managers is None else managers):
+            break
+
+    return row[0] if row else None
+
+
+def inventoryload():
+    with tracespan("inventory.db", "file", operation="load"):
+        inventory = openinventory()
+        packages = dict(inventory.execute("SELECT name, manager FROM installed").fetchall())
+        inventory.close()
+
+    return packages
+
+
+def inventoryset(packages: dict):
+    with tracespan("inventory.db", "file", operation="set", rows=len(packages)):
+        inventory = openinventory()
+        with inventory:
+            inventory.executemany("INSERT OR REPLACE INTO installed (name, manager) VALUES (?, ?)", packages.items())
+            countinventorychange(inventory)
+        inventory.close()
+
+
+def inventoryremove(packages: list[str]):
+    with tracespan("inventory.db", "file", operation="remove", rows=len(packages)):
+        inventory = openinventory()
+        with inventory:
+            inventory.executemany("DELETE FROM installed WHERE name = ?", [[package] for package in packages])
+            countinventorychange(inventory)
+        inventory.close()
+
+
+def inventorylisted():
+    with tracespan("inventory.db", "file", operation="listed"):
+        inventory = openinventory()
+        listed = {manager: json.loads(stamp) for manager, stamp in inventory.execute("SELECT manager, fingerprint FROM listed").fetchall()}
+        inventory.close()
+
+    return listed
+
+
+def inventorymarklisted(stamps: dict):
+    with tracespan("inventory.db", "file", operation="mark", rows=len(stamps)):
+        inventory = openinventory()
+        with inventory:
+            inventory.executemany("INSERT OR REPLACE INTO listed VALUES (?, ?, ?)", [(manager, json.dumps(stamp), time.time()) for manager, stamp in stamps.items()])
+        inventory.close()
+
+
+def inventoryreplace(records: list[tuple]):
+    with tracespan("inventory.db", "file", operation="dump", rows=len(records)):
+        inventory = openinventory()
+        with inventory:
+            inventory.execute("DELETE FROM installed")
+            inventory.execute("DELETE FROM listed")
+            inventory.executemany("INSERT OR REPLACE INTO installed (name, version, manager) VALUES (?, ?, ?)", records)
+            changes = countinventorychange(inventory)
+            stored = inventory.execute("SELECT name, version, manager FROM installed").fetchall()
+        inventory.close()
+
+    writeinventorybin(stored, changes)
+    writenames("names-installed.txt", [record[0] for record in records])
+
+
+def inventoryreplacemanager(manager: str, records: list[tuple]):
+    with tracespan("inventory.db", "file", operation="dump", rows=len(records)):
+        inventory = openinventory()
+        with inventory:
+            inventory.execute("DELETE FROM installed WHERE manager = ?", [manager])
+            inventory.executemany("INSERT OR REPLACE INTO installed (name, version, manager) VALUES (?, ?, ?)", records)
+            changes = countinventorychange(inventory)
+            stored = inventory.execute("SELECT name, version, manager FROM installed").fetchall()
+        inventory.close()
+
+    writeinventorybin(stored, changes)
+
+
+def invalidatesearchcache(managers: list[str]):
+    daemonrequest({"op": "invalidate", "managers": managers})
+
+    with cachelock:
+        cache = loadsearchcache()
+        stale = [key for key in cache if key.split("\n")[0] in managers]
+
+        if stale:
+            for key in stale:
+                del cache[key]
+            savesearchcache(cache)
+
+
+def snapshotids():
+    if not os.path.isdir(spkgpath("snapshots")):
+        return []
+    return sorted(int(name.split(".")[0]) for name in os.listdir(spkgpath("snapshots")) if name.endswith(".json.gz") and name.split(".")[0].isdigit())
+
+
+def readsnapshot(snapshot: int):
+    path = os.path.join(spkgpath("snapshots"), f"{snapshot}.json.gz")
+    with tracespan(os.path.basename(path), "file", operation="load"):
+        return json.loads(gzip.decompress(open(path, "rb").read()))
+
+
+def loadsnapshot(snapshot: int):
+    # Walks back to the last full snapshot and replays the changes from there, giving {(name, manager): version}
+    chain = [readsnapshot(snapshot)]
+    while chain[-1]["base"] is not None:
+        chain.append(readsnapshot(chain[-1]["base"]))
+
+    packages = {}
+    for entry in reversed(chain):
+        for name, manager in entry["removed"]:
+            packages.pop((name, manager), None)
+        for name, manager, version in entry["added"]:
+            packages[(name, manager)] = version
+
+    return packages
+
+
+def savesnapshot(records: list[tuple]):
+    ids = snapshotids()
+    current = {(record[0], record[2]): record[1] for record in records}
+
+    try:
+        previous = loadsnapshot(ids[-1]) if ids else None
+    except (FileNotFoundError, ValueError, OSError):
+        previous = None
+
+    if previous == current:
+        return None
+
+    snapshot = ids[-1] + 1 if ids else 1
+    if previous is None or (snapshot - 1) % snapshotkeyframe == 0:
+        entry = {"time": time.time(), "base": None, "added": [[key[0], key[1], version] for key, version in current.items()], "removed": []}
+    else:
+        entry = {
+            "time": time.time(),
+            "base": ids[-1],
+            "added": [[key[0], key[1], version] for key, version in current.items() if previous.get(key) != version or key not in previous],
+            "removed": [list(key) for key in previous if key not in current]
+        }
+
+    writeatomic(os.path.join(spkgpath("snapshots"), f"{snapshot}.json.gz"), gzip.compress(json.dumps(entry, separators=(",", ":")).encode()))
+    return snapshot
+
+
+def versionkey(version: str):
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.findall(r"\d+|[a-zA-Z]+", version)]
+
+
+def diffsnapshots(first: dict, second: dict):
+    added = [(key[0], key[1], second[key]) for key in second if key not in first]
+    removed = [(key[0], key[1], first[key]) for key in first if key not in second]
+    changed = [(key[0], key[1], first[key], second[key]) for key in second if key in first and first[key] != second[key]]
+
+    upgraded = [change for change in changed if versionkey(change[3]) >= versionkey(change[2])]
+    downgraded = [change for change in changed if versionkey(change[3]) < versionkey(change[2])]
+
+    return {"added": sorted(added), "removed": sorted(removed), "upgraded": sorted(upgraded), "downgraded": sorted(downgraded)}
+
+
+def showdiff(snapshots: list[str], asjson: bool):
+    ids = snapshotids()
+    if len(ids) < 2 and len(snapshots) < 2:
+        print("\033[31;1mError:\033[0m At least two snapshots are needed, every \"spkg scan\" that finds changes takes one")
+        sys.exit()
+
+    first = int(snapshots[0]) if snapshots else ids[-2]
+    second = int(snapshots[1]) if len(snapshots) > 1 else ids[-1]
+
+    try:
+        changes = diffsnapshots(loadsnapshot(first), loadsnapshot(second))
+    except FileNotFoundError:
+        print(f"\033[31;1mError:\033[0m Snapshot not found, available snapshots are {", ".join(str(i) for i in ids) or "none"}")
+        sys.exit()
+
+    if asjson:
+        print(json.dumps({"from": first, "to": second} | changes, indent=True))
+        return
+
+    print(f"Changes from snapshot \033[1m{first}\033[0m to \033[1m{second}\033[0m")
+    for name, manager, version in changes["added"]:
+        print(f"  \033[32;1m+\033[0m {name} {version} ({manager})")
+    for name, manager, version in changes["removed"]:
+        print(f"  \033[31;1m-\033[0m {name} {version} ({manager})")
+    for name, manager, old, new in changes["upgraded"] + changes["downgraded"]:
+        print(f"  \033[33;1m~\033[0m {name} {old} -> {new} ({manager})")
+    print(f"\033[1m{len(changes["added"])} added, {len(changes["removed"])} removed, {len(changes["upgraded"])} upgraded, {len(changes["downgraded"])} downgraded\033[0m")
+
+
+def popflag(args: list[str], flag: str):
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+
+def popoption(args: list[str], option: str, default=None):
+    for i in range(len(args)):
+        if args[i].startswith(option + "="):
+            return args.pop(i).split("=", 1)[1]
+        if args[i] == option and i + 1 < len(args):
+            value = args[i + 1]
+            del args[i:i + 2]
+            return value
+    return default
+
+
+def commandbinary(command: str):
+    words = command.split()
+    if words[0] == "sudo":
+        words = words[1:]
+    return words[0]
+
+
+def runcommand(command: str, timeout: float | None = None, label: str | None = None):
+    with tracespan(label or command, "command", command=command) as details:
+        try:
+            out = sub.run([command], shell=True, capture_output=True, text=True, timeout=timeout)
+        except sub.TimeoutExpired:
+            details["exitcode"] = "timeout"
+            return None
+
+        details.update(exitcode=out.returncode, stdout=len(out.stdout), stderr=len(out.stderr))
+        return out
+
+
+def system(command: str, label: str | None = None):
+    with tracespan(label or command, "command", command=command) as details:
+        status = os.system(command)
+        details["exitcode"] = os.waitstatus_to_exitcode(status) if os.name == "posix" else status
+        return status
+
+
+def runconcurrently(commands: dict, workers: int, timeout: float | None = None, durations: dict | None = None):
+    # Yields (name, CompletedProcess) as each command finishes, None in place of the result if it timed out. durations gets how
+    # long each command that finished ran itself, not counting the time it waited for a worker
+    if not commands:
+        return
+
+    def run(name):
+        start = time.time()
+        out = runcommand(commands[name], timeout, " ".join(name) if isinstance(name, tuple) else name)
+        if durations is not None and out is not None:
+            durations[name] = time.time() - start
+        return out
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(commands))) as pool:
+        futures = {pool.submit(run, name): name for name in commands}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def parsedumpavail(output: str):
+    records = []
+    record = {}
+
+    for line in output.splitlines() + [""]:
+        if not line.strip():
+            if "Package" in record:
+                records.append((record["Package"], record.get("Version", ""), record.get("Description", "")))
+            record = {}
+        elif not line.startswith(" ") and ":" in line:
+            key, value = line.split(":", 1)
+            if key in ("Package", "Version", "Description"):
+                record[key] = value.strip()
+            elif key == "Description-en":
+                record.setdefault("Description", value.strip()) # Archives with translated descriptions only carry this one
+
+    return records
+
+
+def parsepacmansl(output: str):
+    records = []
+    for line in output.splitlines():
+        columns = line.split()
+        if len(columns) >= 3:
+            records.append((columns[1], columns[2], ""))
+    return records
+
+
+def parsegemlist(output: str):
+    records = []
+    for line in output.splitlines():
+        if " (" in line:
+            name, versions = line.split(" (", 1)
+            records.append((name.strip(), versions.rstrip(")").split(",")[0].strip(), ""))
+    return records
+
+
+def parsedpkgquery(output: str):
+    # Removed packages keep a row ("rc") while their config files are left, only an installed state ("ii", "hi") counts, as in readdpkg
+    return [(columns[1], columns[2]) for columns in (line.split("\t") for line in output.splitlines()) if len(columns) >= 3 and columns[0][1:2] == "i"]
+
+
+def parsecolumns(output: str):
+    records = []
+    for line in output.splitlines():
+        columns = line.split("\t")
+        if columns[0].strip():
+            columns += ["", ""]
+            records.append((columns[0].strip(), columns[1].strip(), columns[2].strip()))
+    return records
+
+
+def parsenames(output: str):
+    return [(line.strip(), "", "") for line in output.splitlines() if line.strip() and " " not in line.strip()]
+
+
+indexcommands = {
+    "apt": ["apt-cache dumpavail", parsedumpavail],
+    "dnf": ["dnf repoquery --quiet --queryformat '%{name}\\t%{version}\\t%{summary}\\n'", parsecolumns],
+    "pacman": ["pacman -Sl", parsepacmansl],
+    "flatpak": ["flatpak remote-ls --columns=application,version,description", parsecolumns],
+    "homebrew": ["brew formulae", parsenames],
+    "brewcask": ["brew casks", parsenames],
+    "gem": ["gem list --remote", parsegemlist],
+    "spack": ["spack list", parsenames],
+    "guix": ["guix package -A", parsecolumns]
+}
+
+
+def parsetext(output: str):
+    records = []
+    for line in output.strip().splitlines():
+        line = line.strip()
+        if not line or line.startswith("Listing") or line.startswith("Done"):
+            continue
+        columns = line.split()
+        if columns:
+            records.append((columns[0].split("/")[0], ""))
+    return records
+
+
+def parsespaces(output: str):
+    records = []
+    for line in output.splitlines():
+        columns = line.split()
+        if columns:
+            records.append((columns[0], columns[1] if len(columns) > 1 else ""))
+    return records
+
+
+def parsetable(output: str):
+    return parsespaces("\n".join(output.splitlines()[1:])) # Skips the header row
+
+
+def parsepipes(output: str):
+    return [tuple((line.split("|") + [""])[:2]) for line in output.splitlines() if "|" in line]
+
+
+def parsejsonlist(output: str):
+    return [(item["name"], item.get("version", "")) for item in json.loads(output)]
+
+
+def parsenpmtree(output: str):
+    return [(name, info.get("version", "")) for name, info in json.loads(output).get("dependencies", {}).items()]
+
+
+def parsecomposer(output: str):
+    return [(item["name"], item.get("version", "")) for item in json.loads(output).get("installed", [])]
+
+
+def parsecargolist(output: str):
+    records = []
+    for line in output.splitlines():
+        if line and not line[0].isspace() and line.endswith(":"):
+            columns = line[:-1].split()
+            records.append((columns[0], columns[1].lstrip("v") if len(columns) > 1 else ""))
+    return records
+
+
+def parseyarnlist(output: str):
+    return re.findall(r'info "(.+)@([^@"]+)" has binaries', output)
+
+
+def parseportage(output: str):
+    return [(line.strip().split("/")[-1], "") for line in output.splitlines() if line.strip()]
+
+
+def parseespm(output: str):
+    return [(name, "") for name in json.loads(output).keys()]
+
+
+# The cheapest machine readable listing of every package manager and how to read it as (name, version) pairs
+listparsers = {
+    "apt": ["dpkg-query -W -f='${db:Status-Abbrev}\\t${Package}\\t${Version}\\n'", parsedpkgquery],
+    "dnf": ["rpm -qa --queryformat '%{NAME}\\t%{VERSION}-%{RELEASE}\\n'", parsecolumns],
+    "pacman": ["pacman -Q", parsespaces],
+    "flatpak": ["flatpak list --columns=application,version", parsecolumns],
+    "snap": ["snap list", parsetable],
+    "homebrew": ["brew list --formula --versions", parsespaces],
+    "winget": ["winget list", parsetext],
+    "chocolatey": ["choco list --local-only --limit-output", parsepipes],
+    "scoop": ["scoop list", parsetext],
+    "npm": ["npm ls -g --json --depth=0", parsenpmtree],
+    "pip": ["pip list --format=json", parsejsonlist],
+    "gem": ["gem list", parsegemlist],
+    "conda": ["conda list --json", parsejsonlist],
+    "cargo": ["cargo install --list", parsecargolist],
+    "yarn": ["yarn global list", parseyarnlist],
+    "composer": ["composer global show --format=json", parsecomposer],
+    "brewcask": ["brew list --cask --versions", parsespaces],
+    "maven": ["mvn dependency:tree", parsetext],  # Maven doesn't directly list installed packages
+    "spack": ["spack find --format '{name}\\t{version}'", parsecolumns],
+    "guix": ["guix package --list-installed", parsecolumns],
+    "slackpkg": ["slackpkg search installed", parsetext],
+    "zypper": ["rpm -qa --queryformat '%{NAME}\\t%{VERSION}-%{RELEASE}\\n'", parsecolumns],
+    "portage": ["qlist -I", parseportage],
+    "espm": ["sudo espm list -json", parseespm]
+}
+
+
+dpkgstatus = "/var/lib/dpkg/status"
+pacmanlocal = "/var/lib/pacman/local"
+
+
+def pippaths():
+    # The site-packages "pip list" reports, those of the interpreter behind the pip on PATH, or None if they can't be told
+    pip = shutil.which("pip")
+    if pip is None:
+        return None
+    if os.path.dirname(os.path.realpath(pip)) == os.path.realpath(sysconfig.get_paths()["scripts"]):
+        return ownsitepackages()
+
+    try:
+        shebang = open(pip, "rb").readline().decode(errors="replace")
+    except OSError:
+        return None
+    words = shebang[2:].split() if shebang.startswith("#!") else []
+    if len(words) > 1 and os.path.basename(words[0]) == "env":
+        words = [shutil.which(words[1]) or ""]
+    if not words or not os.path.basename(words[0]).startswith("python"):
+        return None # A wrapper script or an executable, the interpreter can't be read from it
+    if os.path.realpath(words[0]) == os.path.realpath(sys.executable):
+        return ownsitepackages()
+
+    # Another interpreter's paths are only certain for a venv of its own: one site-packages, no system or user site
+    prefix = os.path.dirname(os.path.dirname(words[0]))
+    try:
+        venv = open(os.path.join(prefix, "pyvenv.cfg"), "r").read()
+    except OSError:
+        return None # A system or distribution interpreter, which may add dist-packages, lib64 and the like
+    if re.search(r"^include-system-site-packages\s*=\s*true", venv, re.MULTILINE | re.IGNORECASE):
+        return None
+
+    found = set()
+    for lib in ("lib", "lib64"):
+        try:
+            found.update(os.path.realpath(os.path.join(prefix, lib, name, "site-packages")) for name in os.listdir(os.path.join(prefix, lib)) if name.startswith("python") and os.path.isdir(os.path.join(prefix, lib, name, "site-packages")))
+        except OSError:
+            pass
+
+    return list(found) if len(found) == 1 else None
+
+
+def ownsitepackages():
+    # Every site-packages of the interpreter running SPKG, including the dist-packages and lib64 ones distributions add
+    paths = ([site.getusersitepackages()] if site.ENABLE_USER_SITE else []) + site.getsitepackages() # In sys.path order
+    return list({os.path.realpath(path): path for path in paths}.values())
+
+
+def npmpaths():
+    # The global node_modules of the npm on PATH and its @scope directories, as "npm ls -g" lists them
+    npm = shutil.which("npm")
+    if npm is None:
+        return None
+
+    root = os.path.join(os.path.dirname(os.path.dirname(npm)), "lib", "node_modules")
+    try:
+        return [root] + sorted(entry.path for entry in os.scandir(root) if entry.name.startswith("@"))
+    except OSError:
+        return None
+
+
+def readdpkg():
+    if not os.path.isfile(dpkgstatus):
+        return None
+
+    records = []
+    record = {}
+
+    for line in open(dpkgstatus, "r", encoding="utf-8", errors="replace").read().splitlines() + [""]:
+        if not line:
+            if record.get("Status", "").endswith(" installed") and "Package" in record:
+                records.append((record["Package"], record.get("Version", "")))
+            record = {}
+        elif line[0] not in " \t" and ":" in line:
+            key, value = line.split(":", 1)
+            if key in ("Package", "Status", "Version"):
+                record[key] = value.strip()
+
+    return records
+
+
+def readpacman():
+    if not os.path.isdir(pacmanlocal):
+        return None
+
+    records = []
+    for entry in os.scandir(pacmanlocal):
+        if not entry.is_dir():
+            continue
+        try:
+            fields = open(os.path.join(entry.path, "desc"), "r").read().split("\n\n")
+        except FileNotFoundError:
+            continue
+        desc = {field.split("\n")[0]: field.split("\n")[1] for field in fields if field.count("\n") >= 1}
+        if "%NAME%" in desc:
+            records.append((desc["%NAME%"], desc.get("%VERSION%", "")))
+
+    return records
+
+
+def readpip():
+    paths = pippaths()
+    if paths is None:
+        return None
+
+    records = []
+    seen = set()
+    for path in paths:
+        if not os.path.isdir(path):
+            continue
+        for entry in os.scandir(path):
+            if entry.name.endswith(".dist-info"):
+                metadatafile = os.path.join(entry.path, "METADATA")
+            elif entry.name.endswith(".egg-info"):
+                # setup.py installs leave either an egg-info directory holding PKG-INFO or a single PKG-INFO file named *.egg-info
+                metadatafile = os.path.join(entry.path, "PKG-INFO") if entry.is_dir() else entry.path
+            else:
+                continue
+            metadata = {}
+            try:
+                for line in open(metadatafile, "r", encoding="utf-8", errors="replace"):
+                    if not line.strip():
+                        break
+                    if line.startswith("Name:") or line.startswith("Version:"):
+                        metadata[line.split(":")[0]] = line.split(":", 1)[1].strip()
+            except FileNotFoundError:
+                continue
+            # Like pip list, a package installed in several of the directories counts once, from the first one
+            if "Name" in metadata and re.sub(r"[-_.]+", "-", metadata["Name"]).lower() not in seen:
+                seen.add(re.sub(r"[-_.]+", "-", metadata["Name"]).lower())
+                records.append((metadata["Name"], metadata.get("Version", "")))
+
+    return records
+
+
+def readnpm():
+    paths = npmpaths()
+    if paths is None:
+        return None
+
+    root = paths[0]
+
+    records = []
+    for entry in os.scandir(root):
+        packages = [scoped.path for scoped in os.scandir(entry.path)] if entry.name.startswith("@") else [entry.path]
+        for package in packages:
+            try:
+                manifest = json.loads(open(os.path.join(package, "package.json"), "r").read())
+            except (FileNotFoundError, NotADirectoryError, ValueError):
+                continue
+            records.append((manifest.get("name", os.path.basename(package)), manifest.get("version", "")))
+
+    return records
+
+
+# Reads the installed packages straight from the package database instead of starting the package manager
+nativereaders = {
+    "apt": readdpkg,
+    "pacman": readpacman,
+    "pip": readpip,
+    "npm": readnpm
+}
+
+
+def readnative(package_manager: str):
+    if package_manager not in nativereaders:
+        return None
+
+    try:
+        records = nativereaders[package_manager]()
+    except OSError:
+        return None
+
+    return None if records is None else [(record[0], record[1], package_manager) for record in records]
+
+
+def getrecords(package_manager: str, output: str):
+    if not output.strip():
+        return [] # Package manager either isn't installed or hasn't been used to install anything yet
+
+    try:
+        return [(record[0], record[1], package_manager) for record in listparsers[package_manager][1](output)]
+    except (ValueError, KeyError, IndexError, AttributeError, TypeError) as e:
         print(f"Error processing output for {package_manager}: {e}")
+        return []
+
+
+def getpackages(package_manager: str, output: str):
+    return [record[0] for record in getrecords(package_manager, output)]
+
+
+def openindex():
+    index = sqlite3.connect(spkgpath("index.db"), timeout=30)
+    index.execute("CREATE TABLE IF NOT EXISTS packages (manager TEXT, name TEXT, version TEXT, description TEXT)")
+    index.execute("CREATE INDEX IF NOT EXISTS packages_name ON packages (name)")
+    index.execute("CREATE TABLE IF NOT EXISTS indexed (manager TEXT PRIMARY KEY, time REAL, amount INTEGER)")
+
+    try:
+        index.execute("CREATE VIRTUAL TABLE IF NOT EXISTS packages_text USING fts5(manager UNINDEXED, name, description)")
+    except sqlite3.OperationalError:
+        pass # SQLite was built without FTS5, full-text queries fall back to LIKE
+
+    return index
+
+
+def hasfulltext(index):
+    return index.execute("SELECT 1 FROM sqlite_master WHERE name = 'packages_text'").fetchone() is not None
+
+
+def indexedmanagers():
+    if not os.path.exists(spkgpath("index.db")):
+        return {}
+
+    with openindex() as index:
+        return dict(index.execute("SELECT manager, time FROM indexed").fetchall())
+
+
+def searchindex(package: str, managers: list[str], mode: str = "text"):
+    placeholders = ", ".join("?" * len(managers))
+
+    with openindex() as index:
+        rows = index.execute(f"SELECT manager, name, version, description FROM packages WHERE name = ? AND manager IN ({placeholders})", [package] + managers).fetchall()
 
-    return list(packages)
+        if mode in ("prefix", "text"):
+            rows += index.execute(f"SELECT manager, name, version, description FROM packages WHERE name > ? AND name < ? AND manager IN ({placeholders})", [package, package + "\uffff"] + managers).fetchall()
+
+        if mode == "text":
+            if hasfulltext(index):
+                rows += index.execute(f"SELECT manager, name, '', description FROM packages_text WHERE packages_text MATCH ? AND manager IN ({placeholders})", ['"' + package.replace('"', '""') + '"'] + managers).fetchall()
+            else:
+                rows += index.execute(f"SELECT manager, name, version, description FROM packages WHERE (name LIKE ? OR description LIKE ?) AND manager IN ({placeholders})", [f"%{package}%", f"%{package}%"] + managers).fetchall()
+
+    return rows
+
+
+def buildindex():
+    try:
+        installed = readjson(spkgpath("managers.json"))["installed"]
+    except FileNotFoundError:
+        print("\033[31;1mError:\033[0m Package Manager tracking file not found, run \"spkg scan\" first")
+        sys.exit()
+
+    listings = {i: indexcommands[i][0] for i in installed if i in indexcommands}
+
+    for i in installed:
+        if i not in indexcommands:
+            print(f"Indexing \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m: \033[33;1mNo bulk listing\033[0m, searched live")
+
+    with openindex() as index:
+        fulltext = hasfulltext(index)
+
+        for i, out in runconcurrently(listings, searchworkers, indextimeout):
+            if out is None or out.returncode != 0:
+                print(f"Indexing \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m: \033[31;1mFailed\033[0m")
+                continue
+
+            records = indexcommands[i][1](out.stdout)
+
+            index.execute("DELETE FROM packages WHERE manager = ?", [i])
+            index.executemany("INSERT INTO packages VALUES (?, ?, ?, ?)", [(i,) + record for record in records])
+            if fulltext:
+                index.execute("DELETE FROM packages_text WHERE manager = ?", [i])
+                index.executemany("INSERT INTO packages_text VALUES (?, ?, ?)", [(i, record[0], record[2]) for record in records])
+            index.execute("INSERT OR REPLACE INTO indexed VALUES (?, ?, ?)", [i, time.time(), len(records)])
+            index.commit()
+
+            print(f"Indexing \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m: \033[32;1m{len(records)} packages\033[0m", flush=True)
+
+        writenames("names-available.txt", [row[0] for row in index.execute("SELECT DISTINCT name FROM packages")])
+
+
+fingerprintpaths = {
+    "apt": ["/var/lib/dpkg/status"],
+    "dnf": ["/var/lib/rpm", "/usr/lib/sysimage/rpm"],
+    "zypper": ["/var/lib/rpm", "/usr/lib/sysimage/rpm"],
+    "pacman": ["/var/lib/pacman/local"],
+    "flatpak": ["/var/lib/flatpak/app", f"{os.path.expanduser('~')}/.local/share/flatpak/app"],
+    "snap": ["/var/lib/snapd/state.json"],
+    "homebrew": ["/usr/local/Cellar", "/opt/homebrew/Cellar", "/home/linuxbrew/.linuxbrew/Cellar"],
+    "brewcask": ["/usr/local/Caskroom", "/opt/homebrew/Caskroom"],
+    "conda": [f"{os.getenv("CONDA_PREFIX", "")}/conda-meta"],
+    "cargo": [f"{os.path.expanduser('~')}/.cargo/.crates.toml"],
+    "portage": ["/var/db/pkg"],
+    "guix": [f"{os.path.expanduser('~')}/.guix-profile/manifest"]
+}
+
+
+# Package managers whose package database depends on which of their binaries is on PATH
+fingerprintfinders = {
+    "npm": npmpaths,
+    "pip": pippaths
+}
+
+
+def fingerprint(manager: str):
+    paths = fingerprintfinders[manager]() if manager in fingerprintfinders else fingerprintpaths.get(manager, [])
+
+    stats = []
+    for path in paths or []:
+        try:
+            stat = os.stat(path)
+            stats.append([path, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            pass
+
+    return stats or None # Managers without a known package database are always listed again
+
+
+def listmanager(manager: str):
+    records = readnative(manager)
+
+    if records is None:
+        out = runcommand(listparsers[manager][0], listtimeout, f"list {manager}")
+        if out is None:
+            print(f"\033[33;1mWarning:\033[0m Listing packages of \033[34;1m{manager[0].upper() + manager[1:].lower()}\033[0m timed out")
+        records = getrecords(manager, out.stdout if out is not None else "")
+
+    return records
+
+
+def ensureinventory(managers: list[str]):
+    # Lists the package managers whose packages the inventory doesn't hold yet or whose package database changed since
+    listed = inventorylisted()
+    stamps = {manager: fingerprint(manager) for manager in managers}
+    stale = [manager for manager in managers if stamps[manager] is None or manager not in listed or listed[manager] != stamps[manager]]
+
+    if not stale:
+        return False
+
+    if not indaemon:
+        print("Listing installed packages of " + ", ".join(f"\033[34;1m{i[0].upper() + i[1:].lower()}\033[0m" for i in stale), flush=True)
+
+    with ThreadPoolExecutor(max_workers=min(probeworkers, len(stale))) as pool:
+        for manager, records in zip(stale, pool.map(listmanager, stale)):
+            inventoryreplacemanager(manager, records)
+
+    writenames("names-installed.txt", inventoryload())
+    inventorymarklisted({manager: stamps[manager] for manager in stale})
+    return True
+
+
+def detectedmanagers():
+    try:
+        return readjson(spkgpath("managers.json"))["installed"]
+    except FileNotFoundError:
+        print("\033[33;1mWarning:\033[0m Package Manager tracking file not found, creating new one and detecting Package Managers.")
+        return detectmanagers()[1]
+
+
+def findmanagers(full: bool = False):
+    packages, installed = detectmanagers()
+    scanpackages(installed, full)
+    return [packages, installed]
 
 
-def findmanagers():
+def detectmanagers():
     commands = {
         "apt": "apt -version",
         "dnf": "dnf --version",
@@ -83,41 +1250,24 @@ def findmanagers():
         "espm": "sudo espm version"
     }
 
-    list_commands = {
-        "apt": "apt list --installed",
-        "dnf": "dnf list installed",
-        "pacman": "pacman -Q",
-        "flatpak": "flatpak list",
-        "snap": "snap list",
-        "homebrew": "brew list",
-        "winget": "winget list",
-        "chocolatey": "choco list --local-only",
-        "scoop": "scoop list",
-        "npm": "npm list -g --depth=0",
-        "pip": "pip list",
-        "gem": "gem list",
-        "conda": "conda list",
-        "cargo": "cargo install --list",
-        "yarn": "yarn global list",
-        "composer": "composer global show",
-        "brewcask": "brew list --cask",
-        "maven": "mvn dependency:tree",  # Maven doesn't directly list installed packages
-        "spack": "spack find",
-        "guix": "guix package --list-installed",
-        "slackpkg": "slackpkg search installed",
-        "zypper": "zypper se --installed-only",
-        "portage": "qlist -I",
-        "espm": "sudo espm list -json"
-    }
-
     packagemanagers = list(commands.keys())
 
     packages = {}
 
+    probes = {}
+
     for i in packagemanagers:
-        print(f"\033[0mChecking for \033[34;1m{i[0].upper() + i[1:].lower()} ", end="")
-        packages[i] = sub.run([commands[i]], shell=True, capture_output=True, text=True).stdout != ""
-        print({True: "\033[32;1mFound", False: "\033[31;1mNot Found"}[packages[i]])
+        if shutil.which(commandbinary(commands[i])) is None:
+            packages[i] = False
+            print(f"\033[0mChecking for \033[34;1m{i[0].upper() + i[1:].lower()} " + "\033[31;1mNot Found")
+        else:
+            probes[i] = commands[i]
+
+    for i, out in runconcurrently(probes, probeworkers, probetimeout):
+        packages[i] = out is not None and out.stdout != ""
+        print(f"\033[0mChecking for \033[34;1m{i[0].upper() + i[1:].lower()} " + {True: "\033[32;1mFound", False: "\033[31;1mNot Found"}[packages[i]])
+
+    packages = {i: packages[i] for i in packagemanagers}
 
     installed = []
 
@@ -127,226 +1277,802 @@ def findmanagers():
     
     print(f"\033[0mFound \033[1m{len(installed)} package managers\033[22m (searched through \033[1m{len(packagemanagers)} package managers\033[22m)\033[0m")
 
-    if not packages["flatpak"] and os.name == "posix":
-        if {"y": True, "n": False}[input("Flatpak was not found. Do you want to install it? (y/n) :  ")[0].lower()]:
-            installpackage("flatpak")
+    if not sys.stdin.isatty():
+        pass # Nobody to ask, e.g. when run over ssh by "spkg fleet scan"
+
+    elif not packages["flatpak"] and os.name == "posix":
+        if {"y": True, "n": False}[input("Flatpak was not found. Do you want to install it? (y/n) :  ")[0].lower()]:
+            installpackage("flatpak")
+
+    elif not packages["espm"] and os.name == "posix":
+        if {"y": True, "n": False}[input("ESPM was not found. Do you want to install it? (y/n) :  ")[0].lower()]:
+                print(f"Installing \033[1mESPM\033[0m")
+                os.chdir(f"{os.path.expanduser('~')}/espm/")
+                system(f"sudo rm -rf espm")
+                print("Removing old folders")
+                system(f"sudo rm -rf ESPM")
+                print(f"Cloning Git repository (https://github.com/Ferriit/ESPM.git)")
+                system(f"git clone https://github.com/Ferriit/ESPM.git")
+                system(f"sudo mv ESPM espm")
+                os.chdir(f"espm/")
+
+                installcommands = [
+                    "chmod +x espm.py",
+                    "sudo mv espm.py /usr/local/bin/espm",
+                    "sudo chmod +x /usr/local/bin/espm",
+                    "sudo espm reinstall -skip spkg && sudo spkg scan"
+                ]
+
+                for i in installcommands:
+                    system(i)
+
+    writeatomic(spkgpath("managers.json"), json.dumps({"packages": packages, "installed": installed}, indent=True))
+
+    return [packages, installed]
+
+
+def scanpackages(managers: list[str], full: bool = False):
+    print("\nChecking for installed packages")
+    installedpackages = {}
+    stamps = {}
+
+    packageamount = 0
+    skipped = 0
+
+    try:
+        scanstate = {} if full else readjson(spkgpath("scanstate.json"))
+    except (FileNotFoundError, ValueError):
+        scanstate = {}
+
+    for manager in managers:
+        current = fingerprint(manager)
+        stamps[manager] = current
+        if current is not None and scanstate.get(manager, {}).get("fingerprint") == current and "records" in scanstate[manager]:
+            installedpackages[manager] = [tuple(record) for record in scanstate[manager]["records"]]
+            packageamount += len(installedpackages[manager])
+            skipped += 1
+            continue
+
+        installedpackages[manager] = listmanager(manager)
+        packageamount += len(installedpackages[manager])
+
+        if current is not None:
+            scanstate[manager] = {"fingerprint": current, "records": installedpackages[manager]}
+        else:
+            scanstate.pop(manager, None)
+
+    writeatomic(spkgpath("scanstate.json"), json.dumps(scanstate))
+
+    reordered = {}
+
+    for manager in list(installedpackages.keys()):
+        for record in installedpackages[manager]:
+            reordered[record[0]] = record
+
+    print(f"Found \033[1m{packageamount} packages\033[0m (skipped \033[1m{skipped} package managers\033[0m with unchanged package databases)")
+
+    installedpackages["amount"] = packageamount
+
+    inventoryreplace(list(reordered.values()))
+    inventorymarklisted(stamps)
+    countmetric("scans")
+
+    snapshot = savesnapshot([record for manager in managers for record in installedpackages[manager]])
+    if snapshot is not None:
+        print(f"Saved snapshot \033[1m{snapshot}\033[0m of the inventory (compare scans with \"spkg diff\")")
+
+    return installedpackages
+
+
+
+def parseaptsearch(output: str):
+    records = []
+    for line in output.splitlines():
+        if line and not line[0].isspace() and "/" in line:
+            columns = line.split()
+            records.append([columns[0].split("/")[0], columns[1] if len(columns) > 1 else "", ""])
+        elif line.strip() and records and not records[-1][2]:
+            records[-1][2] = line.strip()
+    return records
+
+
+def parsepacmansearch(output: str):
+    records = []
+    for line in output.splitlines():
+        if line and not line[0].isspace() and "/" in line:
+            columns = line.split()
+            records.append([columns[0].split("/")[-1], columns[1] if len(columns) > 1 else "", ""])
+        elif line.strip() and records and not records[-1][2]:
+            records[-1][2] = line.strip()
+    return records
+
+
+def parsednfsearch(output: str):
+    records = []
+    for line in output.splitlines():
+        if " : " in line and not line.startswith("="):
+            name, summary = line.split(" : ", 1)
+            records.append([name.strip().rsplit(".", 1)[0], "", summary.strip()])
+    return records
+
+
+def parseflatpaksearch(output: str):
+    records = []
+    for line in output.splitlines():
+        columns = line.split("\t")
+        if len(columns) >= 4:
+            records.append([columns[2], columns[3], columns[1]])
+    return records
+
+
+def parsesnapfind(output: str):
+    records = []
+    for line in output.splitlines()[1:]:
+        columns = line.split()
+        if len(columns) >= 2:
+            records.append([columns[0], columns[1], " ".join(columns[4:])])
+    return records
+
+
+def parsenpmsearch(output: str):
+    records = []
+    for line in output.splitlines():
+        columns = line.split("\t")
+        if len(columns) >= 5:
+            records.append([columns[0], columns[4], columns[1]])
+    return records
+
+
+def parsecargosearch(output: str):
+    records = []
+    for line in output.splitlines():
+        match = re.match(r'(\S+) = "([^"]*)"\s*(?:# (.*))?', line)
+        if match:
+            records.append([match.group(1), match.group(2), match.group(3) or ""])
+    return records
+
+
+def parsegenericsearch(output: str):
+    records = []
+    for line in output.splitlines():
+        if line.strip() and not line[0].isspace() and not line.startswith(("=", "#", "Loading", "Searching")):
+            columns = line.split()
+            records.append([columns[0].split("/")[0], columns[1].strip("()") if len(columns) > 1 else "", ""])
+    return records
+
+
+# How to read each package manager's search output as [name, version, summary] records, parsegenericsearch for the rest
+searchparsers = {
+    "apt": parseaptsearch,
+    "pacman": parsepacmansearch,
+    "dnf": parsednfsearch,
+    "flatpak": parseflatpaksearch,
+    "snap": parsesnapfind,
+    "npm": parsenpmsearch,
+    "cargo": parsecargosearch
+}
+
+
+def trigrams(text: str):
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def editdistance(first: str, second: str):
+    previous = list(range(len(second) + 1))
+    for i in range(len(first)):
+        current = [i + 1]
+        for j in range(len(second)):
+            current.append(min(previous[j + 1] + 1, current[j] + 1, previous[j] + (first[i] != second[j])))
+        previous = current
+    return previous[-1]
+
+
+def rankrecords(query: str, records: list, managers: list[str], limit: int):
+    query = query.lower()
+
+    # Trigram index over the names, so edit distances are only computed for names that share something with the query
+    grams = {}
+    for n in range(len(records)):
+        for gram in trigrams(records[n][0]):
+            grams.setdefault(gram, []).append(n)
+
+    shared = {}
+    for gram in trigrams(query):
+        for n in grams.get(gram, []):
+            shared[n] = shared.get(n, 0) + 1
+
+    candidates = {n for n in shared if query in records[n][0].lower()}
+    candidates.update(heapq.nlargest(max(limit * 20, 200), shared, key=shared.get))
+
+    scored = []
+    for n in candidates:
+        name = records[n][0].lower()
+        tier = 0 if name == query else 1 if name.startswith(query) else 2 if query in name else 3
+        preference = managers.index(records[n][3]) if records[n][3] in managers else len(managers)
+        scored.append((tier, editdistance(query, name) if tier else 0, preference, name, n))
+
+    return [records[score[-1]] for score in heapq.nsmallest(limit, scored)]
+
+
+def printrecords(package: str, records: list):
+    if not records:
+        print(f"\033[31;1mError:\033[0m No packages matching \"{package}\" were found")
+        return
+
+    width = max(len(record[0]) for record in records) + 2
+    print(f"\n\033[1m{'Name':<{width}}{'Version':<16}{'Manager':<12}Summary\033[0m")
+    for record in records:
+        print(f"{record[0]:<{width}}{record[1][:15]:<16}\033[34;1m{record[3][0].upper() + record[3][1:].lower():<12}\033[0m{record[2][:80]}")
+
+
+def showsearch(packages: list[str]):
+    records = {}
+
+    if searchjson:
+        searchpackages(packages, lambda manager, package, result, source, packages: None, records=records)
+    else:
+        searchpackages(packages, records=records)
+
+    try:
+        installed = readjson(spkgpath("managers.json"))["installed"]
+    except (FileNotFoundError, ValueError):
+        installed = []
+
+    # The same package can come from both the index and a live search, keep the entry that knows the most
+    for package in packages:
+        unique = {}
+        for record in records[package]:
+            key = (record[0], record[3])
+            if key not in unique or (not unique[key][1] and record[1]):
+                unique[key] = record
+        records[package] = list(unique.values())
+
+    ranked = {package: rankrecords(package, records[package], installed, searchlimit) for package in packages}
+
+    if searchjson:
+        print(json.dumps({package: [{"name": record[0], "version": record[1], "summary": record[2], "manager": record[3]} for record in ranked[package]] for package in packages}, indent=True))
+    else:
+        for package in packages:
+            printrecords(package, ranked[package])
+
+
+def printsearchresult(manager: str, package: str, result: bool | None, source: str, packages: list[str]):
+    target = f" for \033[1m{package}\033[0m" if len(packages) > 1 else ""
+    answer = {True: "\033[32;1mFound\033[0m", False: "\033[31;1mNot Found\033[0m", None: "\033[33;1mTimed Out\033[0m"}[result]
+    print(f"Checking \033[34;1m{manager[0].upper() + manager[1:].lower()}\033[0m{target}: {answer}" + (f" ({source})" if source else ""), flush=True)
+
+
+searchcommands = {
+    "apt": "apt search ",
+    "dnf": "dnf search ",
+    "pacman": "pacman -Ss ",
+    "flatpak": "flatpak search ",
+    "snap": "snap find ",
+    "homebrew": "brew search ",
+    "winget": "winget search ",
+    "chocolatey": "choco search ",
+    "scoop": "scoop search ",
+    "npm": "npm search --parseable ",
+    "pip": "pip search ",
+    "gem": "gem search ",
+    "conda": "conda search ",
+    "cargo": "cargo search ",
+    "yarn": "yarn search ",
+    "composer": "composer search ",
+    "brewcask": "brew cask search ",
+    "maven": "mvn dependency:search -DartifactId=",
+    "spack": "spack search ",
+    "guix": "guix search ",
+    "slackpkg": "slackpkg search ",
+    "zypper": "zypper search ",
+    "portage": "emerge --search ",
+    "espm": "sudo espm search "
+}
+
+
+def searchpackages(packages: list[str], report=printsearchresult, timeout: float | None = None, records: dict | None = None, managers: list[str] | None = None, mode: str | None = None, cachelife: float | None = None, indexlife: float | None = None):
+    timeout = timeout or searchtimeout
+    records = {} if records is None else records
+    mode = mode or searchmode
+    cachelife = cachettl if cachelife is None else cachelife
+    indexlife = indexttl if indexlife is None else indexlife
+
+    try:
+        packagemanagers = readjson(spkgpath("managers.json"))
+
+    except FileNotFoundError:
+        print("\033[33;1mWarning:\033[0m Package Manager tracking file not found, creating new one and detecting Package Managers.")
+        detectmanagers()
+        packagemanagers = readjson(spkgpath("managers.json"))
+
+    if managers is not None:
+        packagemanagers["installed"] = [i for i in packagemanagers["installed"] if i in managers]
+
+    results = {package: [] for package in packages}
+    records.update({package: [] for package in packages})
+    searches = {}
+
+    answers = {}
+    if usecache: # --no-cache means searching live, which the daemon's remembered results would defeat
+        answers = {package: daemonrequest({"op": "search", "package": package, "timeout": timeout, "mode": mode, "cachettl": cachelife, "indexttl": indexlife}, timeout + 5) for package in packages}
+
+    if answers and None not in answers.values():
+        countmetric("search_daemon_answers", len(packages) * len(packagemanagers["installed"]))
+        for package in packages:
+            records[package] = [record for record in answers[package]["records"] if record[3] in packagemanagers["installed"]]
+            for i, result in answers[package]["results"].items():
+                if i not in packagemanagers["installed"]:
+                    continue
+                report(i, package, result, "daemon", packages)
+                if result:
+                    results[package].append(i)
+
+        return {package: [i for i in answers[package]["results"] if i in results[package]] for package in packages}
+
+    cache = loadsearchcache() if usecache else {}
+    touched = {}
+
+    indexed = indexedmanagers()
+    fresh = [i for i in packagemanagers["installed"] if time.time() - indexed.get(i, 0) <= indexlife]
+
+    for package in packages:
+        rows = searchindex(package, fresh, mode) if fresh else []
+        found = {row[0] for row in rows}
+        records[package] += [[row[1], row[2], row[3], row[0]] for row in rows]
+
+        countmetric("search_index_answers", len(fresh))
+        for i in fresh:
+            report(i, package, i in found, "index", packages)
 
-    elif not packages["espm"] and os.name == "posix":
-        if {"y": True, "n": False}[input("ESPM was not found. Do you want to install it? (y/n) :  ")[0].lower()]:
-                print(f"Installing \033[1mESPM\033[0m")
-                os.chdir(f"{os.path.expanduser('~')}/espm/")
-                os.system(f"sudo rm -rf espm")
-                print("Removing old folders")
-                os.system(f"sudo rm -rf ESPM")
-                print(f"Cloning Git repository (https://github.com/Ferriit/ESPM.git)")
-                os.system(f"git clone https://github.com/Ferriit/ESPM.git")
-                os.system(f"sudo mv ESPM espm")
-                os.chdir(f"espm/")
+            if i in found:
+                results[package].append(i)
 
-                installcommands = [
-                    "chmod +x espm.py",
-                    "sudo mv espm.py /usr/local/bin/espm",
-                    "sudo chmod +x /usr/local/bin/espm",
-                    "sudo espm reinstall -skip spkg && sudo spkg scan"
-                ]
+        for i in packagemanagers["installed"]:
+            if i in fresh:
+                continue
 
-                for i in installcommands:
-                    os.system(i)
+            entry = cache.get(f"{i}\n{package}")
 
-    if os.name == "posix":
-        try:
-            open(f"{os.path.expanduser('~')}/spkg/managers.json", "w").write(json.dumps({"packages": packages, "installed": installed}, indent=True))
-        except FileNotFoundError:
-            os.system(f"sudo mkdir {os.path.expanduser('~')}/spkg")
-            open(f"{os.path.expanduser('~')}/spkg/managers.json", "w").write(json.dumps({"packages": packages, "installed": installed}, indent=True))
-    elif os.name == "nt":
-        open(f"{os.getenv("APPDATA")}/spkg/managers.json", "w").write(json.dumps({"packages": packages, "installed": installed}, indent=True))
-    
-    print("\nChecking for installed packages")
-    installedpackages = {}
-    
-    managers = list(commands.keys())
+            if entry is None or time.time() - entry["time"] > cachelife:
+                searches[(i, package)] = searchcommands[i] + package
+                countmetric("search_cache_misses")
+                continue
 
-    packageamount = 0
+            countmetric("search_cache_hits")
+            touched[f"{i}\n{package}"] = entry
+            records[package] += entry.get("records", [])
+            report(i, package, entry["found"], "cached", packages)
 
-    for manager in managers:
-        out = sub.run([list_commands[manager]], shell=True, capture_output=True, text=True)
-        if not manager == "espm":
-            installedpackages[manager] = getpackages(manager, out.stdout)
-        else:
-            #os.system("sudo espm list -json")
-            installedpackages[manager] = list(json.loads(out.stdout).keys())
-        packageamount += len(installedpackages[manager])
+            if entry["found"]:
+                results[package].append(i)
 
-    reordered = {}
+    durations = {}
 
-    for manager in list(installedpackages.keys()):
-        for package in installedpackages[manager]:
-            reordered[package] = manager
+    for (i, package), out in runconcurrently(searches, searchworkers, timeout, durations):
+        if out is None:
+            report(i, package, None, "", packages)
+            continue
 
-    print(f"Found \033[1m{packageamount} packages\033[0m")
+        firstresult = out.stdout
+        result = package in firstresult and "not found" not in firstresult.lower()
+        report(i, package, result, "", packages)
 
-    installedpackages["amount"] = packageamount
+        parsed = [record + [i] for record in searchparsers.get(i, parsegenericsearch)(firstresult)] if result else []
+        parsed = rankrecords(package, parsed, [i], cachedrecords)
+        records[package] += parsed
 
-    if os.name == "posix":
-        open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write(json.dumps(reordered, indent=True))
-    elif os.name == "nt":
-        open(f"{os.getenv("APPDATA")}/spkg/installed.json", "w").write(json.dumps(reordered, indent=True))
+        touched[f"{i}\n{package}"] = {"time": time.time(), "found": result, "records": parsed}
 
-    return [packages, installed]
+        if result:
+            results[package].append(i)
 
+    if usecache and touched:
+        updatesearchcache(touched) # Hits too, so the least recently used results are the ones evicted
+
+    if durations:
+        latencies = {}
+        for (i, package), seconds in durations.items():
+            latencies.setdefault(i, []).append(seconds)
+        learnranking(latencies={i: sum(seconds) / len(seconds) for i, seconds in latencies.items()})
+
+    return {package: [i for i in packagemanagers["installed"] if i in results[package]] for package in packages}
 
 
 def searchpackage(package):
-    commands = {
-        "apt": "apt search ",
-        "dnf": "dnf search ",
-        "pacman": "pacman -Ss ",
-        "flatpak": "flatpak search ",
-        "snap": "snap find ",
-        "homebrew": "brew search ",
-        "winget": "winget search ",
-        "chocolatey": "choco search ",
-        "scoop": "scoop search ",
-        "npm": "npm search ",
-        "pip": "pip search ",
-        "gem": "gem search ",
-        "conda": "conda search ",
-        "cargo": "cargo search ",
-        "yarn": "yarn search ",
-        "composer": "composer search ",
-        "brewcask": "brew cask search ",
-        "maven": "mvn dependency:search -DartifactId=",
-        "spack": "spack search ",
-        "guix": "guix search ",
-        "slackpkg": "slackpkg search ",
-        "zypper": "zypper search ",
-        "portage": "emerge --search ",
-        "espm": "sudo espm search "
-    }
+    return searchpackages([package])[package]
+
 
+def loadranking():
     try:
-        if os.name == "posix":
-            packagemanagers = json.loads(open(f"{os.path.expanduser('~')}/spkg/managers.json", "r").read())
-        elif os.name == "nt":
-            packagemanagers = json.loads(open(f"{os.getenv("APPDATA")}/spkg/managers.json", "r").read())
+        return readjson(spkgpath("ranking.json"))
+    except (FileNotFoundError, ValueError):
+        return {"installs": {}, "latency": {}}
 
-    except FileNotFoundError:
-        print("\033[33;1mWarning:\033[0m Package Manager tracking file not found, creating new one and scanning Package Managers.")
-        findmanagers()
-        if os.name == "posix":
-            packagemanagers = json.loads(open(f"{os.path.expanduser('~')}/spkg/managers.json", "r").read())
-        elif os.name == "nt":
-            packagemanagers = json.loads(open(f"{os.getenv("APPDATA")}/spkg/managers.json", "r").read())
 
+def learnranking(installs: list[str] = [], latencies: dict = {}):
+    with rankinglock:
+        ranking = loadranking()
+        for manager in installs:
+            ranking["installs"][manager] = ranking["installs"].get(manager, 0) + 1
+        for manager, seconds in latencies.items():
+            previous = ranking["latency"].get(manager)
+            ranking["latency"][manager] = seconds if previous is None else previous * 0.7 + seconds * 0.3
+        writeatomic(spkgpath("ranking.json"), json.dumps(ranking))
 
-    results = []
 
-    for i in packagemanagers["installed"]:
-        print(f"Checking \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m: ", end="", flush=True)
-        firstresult = sub.run([commands[i] + package], shell=True, capture_output=True, text=True).stdout
-        result = package in firstresult and "not found" not in firstresult.lower()
-        print({True: "\033[32;1mFound\033[0m", False: "\033[31;1mNot Found\033[0m"}[result])
-        
-        if result:
-            results.append(i)
+def rankedmanagers(managers: list[str]):
+    # Package managers that were installed with most come first, the quickest to answer searches break ties
+    ranking = loadranking()
+    return sorted(managers, key=lambda i: (-ranking["installs"].get(i, 0), ranking["latency"].get(i, searchtimeout)))
 
-    return results
 
+def offerspackage(manager: str, package: str, output: str):
+    # Only a package of exactly that name counts, "vim-flavor" in the output doesn't offer "vi"
+    return any(record[0].lower() == package.lower() for record in searchparsers.get(manager, parsegenericsearch)(output))
 
-def installpackage(package):
+
+def killprocess(process):
     try:
         if os.name == "posix":
-            installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-        elif os.name == "nt":
-            installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
+            os.killpg(process.pid, signal.SIGKILL) # Takes the shell and whatever it started
+        else:
+            process.kill()
+    except OSError:
+        pass # Already gone
+
+
+def racecommands(commands: dict, settle, timeout: float | None = None):
+    # Runs the commands at the same time and hands each result to settle(name, CompletedProcess or None) as it arrives. Once
+    # settle returns True the commands still running are killed and the ones not started yet are dropped
+    processes = {}
+    latencies = {}
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def run(name):
+        with tracespan(f"race {name}", "command", command=commands[name]) as details:
+            with lock:
+                if stopped.is_set():
+                    details["exitcode"] = "cancelled"
+                    return None
+                start = time.time()
+                process = processes[name] = sub.Popen([commands[name]], shell=True, stdin=sub.DEVNULL, stdout=sub.PIPE, stderr=sub.PIPE, text=True, start_new_session=os.name == "posix")
+
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except sub.TimeoutExpired:
+                killprocess(process)
+                process.communicate()
+                details["exitcode"] = "timeout"
+                return None
+
+            details["exitcode"] = process.returncode
+            if not stopped.is_set():
+                latencies[name] = time.time() - start
+            return sub.CompletedProcess(commands[name], process.returncode, stdout, stderr)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(searchworkers, len(commands)))) as pool:
+        futures = {pool.submit(run, name): name for name in commands}
+        for future in as_completed(futures):
+            if stopped.is_set():
+                continue
+            if settle(futures[future], future.result()):
+                with lock:
+                    stopped.set()
+                    for process in processes.values():
+                        if process.poll() is None:
+                            killprocess(process)
+
+    return latencies
+
+
+def racepackage(package: str, order: list[str]):
+    # Gives the first package manager in order that has the package, without waiting for the ones after it to answer
+    results = {}
+
+    indexed = indexedmanagers()
+    fresh = [i for i in order if time.time() - indexed.get(i, 0) <= indexttl]
+    if fresh:
+        found = {row[0] for row in searchindex(package, fresh, "exact")}
+        countmetric("search_index_answers", len(fresh))
+        for i in fresh:
+            results[i] = i in found
+            printsearchresult(i, package, results[i], "index", [package])
+
+    cache = loadsearchcache() if usecache else {}
+    touched = {}
+    for i in order:
+        entry = cache.get(f"{i}\n{package}")
+        if i not in results and entry is not None and time.time() - entry["time"] <= cachettl and "records" in entry:
+            results[i] = entry["found"] and any(record[0].lower() == package.lower() for record in entry["records"])
+            printsearchresult(i, package, results[i], "cached", [package])
+            countmetric("search_cache_hits")
+            touched[f"{i}\n{package}"] = entry
+
+    if touched:
+        updatesearchcache(touched)
+
+    def decided():
+        for i in order:
+            if i not in results:
+                return False
+            if results[i]:
+                return True
+        return True
+
+    def settle(i, out):
+        results[i] = out is not None and offerspackage(i, package, out.stdout)
+        printsearchresult(i, package, None if out is None else results[i], "", [package])
+        return decided()
+
+    if not decided():
+        countmetric("search_cache_misses", len([i for i in order if i not in results]))
+        learnranking(latencies=racecommands({i: searchcommands[i] + shlex.quote(package) for i in order if i not in results}, settle, searchtimeout))
+
+    return next((i for i in order if results.get(i)), None)
+
+
+def parseaptpolicy(output: str):
+    names = set()
+    name = None
+    for line in output.splitlines():
+        if line and not line[0].isspace() and line.endswith(":"):
+            name = line[:-1]
+        elif line.strip().startswith("Candidate:") and "(none)" not in line and name is not None:
+            names.add(name)
+    return names
+
+
+def parseinfonames(output: str):
+    return {line.split(":", 1)[1].strip() for line in output.splitlines() if re.match(r"name\s*:", line, re.IGNORECASE)}
+
+
+def parseflatpakids(output: str):
+    names = set()
+    for line in output.splitlines():
+        if line.strip():
+            names.update([line.strip(), line.strip().split(".")[-1]])
+    return names
+
+
+# Lookups that answer many names with one call: [command, parser returning the available names, whether the names are appended]
+batchcommands = {
+    "apt": ["apt-cache policy", parseaptpolicy, True],
+    "pacman": ["pacman -Si", parseinfonames, True],
+    "dnf": ["dnf info --available", parseinfonames, True],
+    "zypper": ["zypper --non-interactive info", parseinfonames, True],
+    "snap": ["snap info", parseinfonames, True],
+    "flatpak": ["flatpak remote-ls --columns=application", parseflatpakids, False]
+}
+
+
+def batchsearch(packages: list[str]):
+    installed = detectedmanagers()
+
+    available = {package: set() for package in packages}
+    chunks = [packages[i:i + batchsize] for i in range(0, len(packages), batchsize)]
+
+    indexed = indexedmanagers()
+    fresh = [i for i in installed if time.time() - indexed.get(i, 0) <= indexttl]
+
+    if fresh:
+        with openindex() as index:
+            for chunk in chunks:
+                placeholders = ", ".join("?" * len(chunk))
+                for manager, name in index.execute(f"SELECT manager, name FROM packages WHERE name IN ({placeholders}) AND manager IN ({', '.join('?' * len(fresh))})", chunk + fresh):
+                    available[name].add(manager)
+
+    lookups = {}
+    for i in installed:
+        if i in fresh or i not in batchcommands:
+            continue
+        if batchcommands[i][2]:
+            for n in range(len(chunks)):
+                lookups[(i, str(n))] = batchcommands[i][0] + " " + " ".join(shlex.quote(package) for package in chunks[n])
+        else:
+            lookups[(i, "all")] = batchcommands[i][0]
+
+    for (i, chunk), out in runconcurrently(lookups, searchworkers, searchtimeout):
+        if out is None:
+            print(f"\033[33;1mWarning:\033[0m {i[0].upper() + i[1:].lower()} timed out, its column is incomplete", file=sys.stderr)
+            continue
+        names = batchcommands[i][1](out.stdout) # Missing names make some of these exit non-zero, the found ones are still listed
+        for package in packages:
+            if package in names:
+                available[package].add(i)
+
+    # Managers without a bulk lookup are searched name by name, counting only exact name matches where the output can be parsed
+    rest = [i for i in installed if i not in fresh and i not in batchcommands]
+    if rest:
+        records = {}
+        found = searchpackages(packages, lambda manager, package, result, source, packages: None, records=records, managers=rest)
+        for package in packages:
+            for i in found[package]:
+                if i not in searchparsers or any(record[3] == i and record[0].lower() == package.lower() for record in records[package]):
+                    available[package].add(i)
+
+    return {package: [i for i in installed if i in available[package]] for package in packages}
+
+
+def showbatch(source: str, ascsv: bool):
+    text = sys.stdin.read() if source == "-" else open(source, "r").read()
+    packages = list(dict.fromkeys(word for line in text.splitlines() for word in line.split("#")[0].split()))
+
+    results = batchsearch(packages)
+
+    if ascsv:
+        installed = readjson(spkgpath("managers.json"))["installed"]
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["name"] + installed)
+        for package in packages:
+            writer.writerow([package] + [int(i in results[package]) for i in installed])
+    else:
+        print(json.dumps(results, indent=True))
+
+
+installcommands = {
+    "apt": "sudo apt install ",
+    "dnf": "sudo dnf install ",
+    "pacman": "sudo pacman -S ",
+    "flatpak": "flatpak install ",
+    "snap": "sudo snap install ",
+    "homebrew": "brew install ",
+    "winget": "winget install ",
+    "chocolatey": "choco install ",
+    "scoop": "scoop install ",
+    "npm": "npm install -g ",
+    "pip": "pip install ",
+    "gem": "gem install ",
+    "conda": "conda install ",
+    "cargo": "cargo install ",
+    "yarn": "yarn global add ",
+    "composer": "composer require ",
+    "brewcask": "brew install --cask ",
+    "maven": "mvn install:install-file -Dfile=",
+    "spack": "spack install ",
+    "guix": "guix package -i ",
+    "slackpkg": "slackpkg install ",
+    "zypper": "sudo zypper install ",
+    "portage": "sudo emerge ",
+    "espm": "sudo espm install -skip "
+}
+
+# Flags that keep an install from asking anything, used by restore
+confirmflags = {
+    "apt": "-y ",
+    "dnf": "-y ",
+    "pacman": "--noconfirm --needed ",
+    "flatpak": "-y --noninteractive ",
+    "snap": "",
+    "homebrew": "",
+    "winget": "--accept-package-agreements --accept-source-agreements ",
+    "chocolatey": "-y ",
+    "scoop": "",
+    "npm": "",
+    "pip": "",
+    "gem": "--no-document ",
+    "conda": "-y ",
+    "cargo": "",
+    "yarn": "--non-interactive ",
+    "composer": "--no-interaction ",
+    "brewcask": "",
+    "maven": "",
+    "spack": "-y ",
+    "guix": "",
+    "slackpkg": "-batch=on -default_answer=y ",
+    "zypper": "-y ",
+    "portage": "",
+    "espm": ""
+}
+
+# How a package is pinned to a version on the command line, managers missing here are restored at their latest version
+pinformats = {
+    "apt": "{name}={version}",
+    "dnf": "{name}-{version}",
+    "zypper": "{name}={version}",
+    "npm": "{name}@{version}",
+    "yarn": "{name}@{version}",
+    "pip": "{name}=={version}",
+    "conda": "{name}={version}",
+    "composer": "{name}:{version}"
+}
+
+
+def installpackages(packages: list[str], yes: bool = False, prefer: list[str] | None = None):
+    toinstall = []
+
+    for package in packages:
+        installedwith = inventoryget(package, [])
+
+        if installedwith is not None:
+            print(f"\033[33;1mWarning:\033[0m Package {package} already installed with \033[34;1m{installedwith[0].upper() + installedwith[1:].lower()}\033[0m")
+        elif package not in toinstall:
+            toinstall.append(package)
+
+    if not toinstall:
+        sys.exit()
 
-    except FileNotFoundError:
-        print("\033[33;1mWarning:\033[0m Installation tracking file not found, creating new one.")
-        if os.name == "posix":
-            open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write("{}")
-        elif os.name == "nt":
-            open(f"{os.getenv("APPDATA")}/spkg/installed.json", "w").write("{}")
-        
-        if os.name == "posix":
-            installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-        elif os.name == "nt":
-            installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
+    if yes:
+        installed = detectedmanagers()
+        order = [i for i in prefer if i in installed] if prefer else rankedmanagers(installed)
+        found = {}
+        for package in toinstall:
+            winner = racepackage(package, order)
+            found[package] = [] if winner is None else [winner]
+    else:
+        found = searchpackages(toinstall)
 
-    if package in list(installedpackages.keys()):
-        installedwith = installedpackages[package]
-        print(f"\033[33;1mWarning:\033[0m Package {package} already installed with \033[34;1m{installedwith[0].upper() + installedwith[1:].lower()}\033[0m")
-        sys.exit()
+    # Only the package managers that offer one of the packages need their installed packages listed to rule out duplicates
+    if ensureinventory(list(dict.fromkeys(i for package in toinstall for i in found[package]))):
+        for package in list(toinstall):
+            installedwith = inventoryget(package, [])
+            if installedwith is not None:
+                print(f"\033[33;1mWarning:\033[0m Package {package} already installed with \033[34;1m{installedwith[0].upper() + installedwith[1:].lower()}\033[0m")
+                toinstall.remove(package)
 
-    available = searchpackage(package)
+    chosen = {}
 
-    commands = {
-        "apt": "sudo apt install ",
-        "dnf": "sudo dnf install ",
-        "pacman": "sudo pacman -S ",
-        "flatpak": "flatpak install ",
-        "snap": "sudo snap install ",
-        "homebrew": "brew install ",
-        "winget": "winget install ",
-        "chocolatey": "choco install ",
-        "scoop": "scoop install ",
-        "npm": "npm install -g ",
-        "pip": "pip install ",
-        "gem": "gem install ",
-        "conda": "conda install ",
-        "cargo": "cargo install ",
-        "yarn": "yarn global add ",
-        "composer": "composer require ",
-        "brewcask": "brew install --cask ",
-        "maven": "mvn install:install-file -Dfile=",
-        "spack": "spack install ",
-        "guix": "guix package -i ",
-        "slackpkg": "slackpkg install ",
-        "zypper": "sudo zypper install ",
-        "portage": "sudo emerge ",
-        "espm": "sudo espm install -skip "
-    }
+    for package in toinstall:
+        available = found[package]
 
-    print(f"Please choose a package manager to install \"{package}\" with")
+        if not available:
+            print(f"\033[31;1mError:\033[0m Package \"{package}\" wasn't found by any package manager")
+            continue
 
-    out = ""
-    for i in range(len(available)):
-        out += str(i + 1) + ": " + available[i][0].upper() + available[i][1:].lower() + ", "
+        if yes:
+            print(f"Installing \"{package}\" with \033[34;1m{available[0][0].upper() + available[0][1:].lower()}\033[0m")
+            chosen.setdefault(available[0], []).append(package)
+            continue
 
-    confirm = True
+        print(f"Please choose a package manager to install \"{package}\" with")
 
-    while confirm:
-        choice = int(input(out[:-2] + " (0 to abort) :  ")) - 1
+        out = ""
+        for i in range(len(available)):
+            out += str(i + 1) + ": " + available[i][0].upper() + available[i][1:].lower() + ", "
 
-        if choice == -1:
-            sys.exit()
+        confirm = True
 
-        confirm = {"n": True, "y": False}[input(f"Are you sure you want to use {available[choice][0].upper() + available[choice][1:].lower()}? (y/n) :  ")[0].lower()]
+        while confirm:
+            choice = int(input(out[:-2] + " (0 to abort) :  ")) - 1
 
+            if choice == -1:
+                sys.exit()
 
-    os.system(commands[available[choice]] + package)
+            confirm = {"n": True, "y": False}[input(f"Are you sure you want to use {available[choice][0].upper() + available[choice][1:].lower()}? (y/n) :  ")[0].lower()]
 
-    if os.name == "posix":
-        try:
-            installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-        except FileNotFoundError:
-            open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write("{}")
-            installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-    elif os.name == "nt":
-        try:
-            installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
-        except FileNotFoundError:
-            open(f"{os.getenv("APPDATA")}/spkg/managers.json", "w").write("{}")
-            installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
+        chosen.setdefault(available[choice], []).append(package)
+
+    installed = {}
+    succeeded = []
 
-    installedpackages[package] = available[choice]
+    for manager, names in chosen.items():
+        command = installcommands[manager] + {True: confirmflags[manager], False: ""}[yes]
+        if installcommands[manager].endswith("="):
+            statuses = [system(command + name, f"install {manager}") for name in names] # Takes a single argument, so it can't install several at once
+        else:
+            statuses = [system(command + " ".join(names), f"install {manager}")]
 
-    if os.name == "posix":
-        open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
-    elif os.name == "nt":
-        open(f"{os.getenv("APPDATA")}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
+        if not any(statuses):
+            succeeded.append(manager)
 
-def removepackage(package):
+        # Only what actually got installed goes into the inventory, or a failed batch would block installing it again
+        if len(statuses) < len(names):
+            statuses *= len(names) # One command installed the whole batch, so they share its exit status
+        for name, status in zip(names, statuses):
+            if status == 0:
+                installed[name] = manager
+
+    invalidatesearchcache(list(chosen))
+    inventoryset(installed)
+    learnranking(installs=succeeded)
+
+
+def installpackage(package):
+    installpackages([package])
+
+
+def removepackages(packages: list[str]):
     commands = {
         "apt": "apt remove -y ",
         "dnf": "dnf remove -y ",
@@ -374,25 +2100,121 @@ def removepackage(package):
         "espm": "sudo espm uninstall "
     }
 
-    if os.name == "posix":
-        installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-    elif os.name == "nt":
-        installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
+    chosen = {}
 
-    try:
-        packagemanager = installedpackages[package]
-    except KeyError:
-        print(f"\033[31;1mError: \033[0mPackage \"{package}\" not installed")
+    for package in packages:
+        packagemanager = inventoryget(package)
+
+        if packagemanager is None:
+            print(f"\033[31;1mError: \033[0mPackage \"{package}\" not installed")
+            continue
+
+        if package not in chosen.get(packagemanager, []):
+            chosen.setdefault(packagemanager, []).append(package)
+
+    if not chosen:
         sys.exit()
 
-    del installedpackages[package]
+    inventoryremove([package for names in chosen.values() for package in names])
 
-    if os.name == "posix":
-        open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
-    elif os.name == "nt":
-        open(f"{os.getenv("APPDATA")}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
-    
-    os.system(commands[packagemanager] + package)
+    for manager, names in chosen.items():
+        if commands[manager].endswith("="):
+            for name in names: # Takes a single argument, so it can't remove several at once
+                system(commands[manager] + name, f"uninstall {manager}")
+        else:
+            system(commands[manager] + " ".join(names), f"uninstall {manager}")
+
+    invalidatesearchcache(list(chosen))
+
+
+def removepackage(package):
+    removepackages([package])
+
+
+def exportpackages(path: str):
+    with tracespan("inventory.db", "file", operation="export"):
+        inventory = openinventory()
+        rows = inventory.execute("SELECT name, version, manager FROM installed ORDER BY manager, name").fetchall()
+        inventory.close()
+
+    lockfile = json.dumps({
+        "spkg": version,
+        "time": time.time(),
+        "packages": [{"name": name, "manager": manager, "version": packageversion or ""} for name, packageversion, manager in rows]
+    }, indent=True)
+
+    if path == "-":
+        print(lockfile)
+    else:
+        writeatomic(os.path.abspath(path), lockfile)
+        print(f"Exported \033[1m{len(rows)} packages\033[0m to \033[1m{path}\033[0m")
+
+
+def restorepackages(path: str, pin: bool = True):
+    content = open(path, "r").read()
+    lockfile = json.loads(content)
+    checksum = hashlib.sha256(content.encode()).hexdigest()
+
+    installed = detectedmanagers()
+
+    # The journal remembers which package managers already finished restoring this lockfile, so a rerun picks up where it stopped
+    try:
+        journal = readjson(spkgpath("restore.json"))
+    except (FileNotFoundError, ValueError):
+        journal = {}
+    if journal.get("lockfile") != checksum:
+        journal = {"lockfile": checksum, "done": []}
+    elif journal["done"]:
+        print(f"Resuming the restore of \033[1m{path}\033[0m, already done: " + ", ".join(f"\033[34;1m{i[0].upper() + i[1:].lower()}\033[0m" for i in journal["done"]))
+
+    ensureinventory([i for i in installed if i in {package["manager"] for package in lockfile["packages"]}])
+    present = inventoryload()
+    chosen = {}
+    skipped = 0
+
+    for package in lockfile["packages"]:
+        manager = package["manager"]
+
+        if manager in journal["done"] or present.get(package["name"]) == manager:
+            skipped += 1
+        elif manager not in installed:
+            print(f"\033[33;1mWarning:\033[0m {manager[0].upper() + manager[1:].lower()} isn't installed, skipping \"{package["name"]}\"")
+        elif pin and package["version"] and manager in pinformats:
+            chosen.setdefault(manager, []).append(pinformats[manager].format(name=package["name"], version=package["version"]))
+        else:
+            chosen.setdefault(manager, []).append(package["name"])
+
+    print(f"Restoring \033[1m{sum(len(names) for names in chosen.values())} packages\033[0m ({skipped} already installed or restored)")
+
+    if not chosen:
+        if os.path.exists(spkgpath("restore.json")):
+            os.remove(spkgpath("restore.json"))
+        return
+
+    commands = {}
+    for manager, names in chosen.items():
+        if installcommands[manager].endswith("="):
+            commands[manager] = " && ".join(installcommands[manager] + name for name in names)
+        else:
+            commands[manager] = installcommands[manager] + confirmflags[manager] + " ".join(shlex.quote(name) for name in names)
+
+    writeatomic(spkgpath("restore.json"), json.dumps(journal))
+
+    def finished(manager: str, exitcode: int):
+        if exitcode != 0:
+            return
+        journal["done"].append(manager)
+        writeatomic(spkgpath("restore.json"), json.dumps(journal))
+        inventoryset({package["name"]: manager for package in lockfile["packages"] if package["manager"] == manager})
+
+    results = runupdates(commands, "restore", finished)
+
+    invalidatesearchcache(list(chosen))
+
+    if all(result[0] == 0 for result in results.values()):
+        os.remove(spkgpath("restore.json"))
+    else:
+        print(f"\033[31;1mError:\033[0m Some package managers failed, run \"spkg restore {path}\" again to retry only those")
 
 
 def flagstopackage(flags: list[str]):
@@ -432,10 +2254,7 @@ def flagstopackage(flags: list[str]):
     for i in flags:
         result.append(packageflags[i])
         if i == "-installed":
-            if os.name == "posix":
-                packagemanagers = json.loads(open(f"{os.path.expanduser('~')}/spkg/managers.json", "r").read())
-            elif os.name == "nt":
-                packagemanagers = json.loads(open(f"{os.getenv("APPDATA")}/spkg/managers.json", "r").read())
+            packagemanagers = readjson(spkgpath("managers.json"))
 
             result = packagemanagers["installed"]
             break
@@ -447,11 +2266,245 @@ def flagstopackage(flags: list[str]):
     return result
     
 
-def update(packagemanagerflags: list[str]):
+def runupdate(command: str, logpath: str, label: str | None = None):
+    start = time.time()
+    with tracespan(label or command, "command", command=command) as details:
+        with open(logpath, "w") as log:
+            exitcode = sub.run([command], shell=True, stdin=sub.DEVNULL, stdout=log, stderr=sub.STDOUT).returncode
+        details.update(exitcode=exitcode, stdout=os.path.getsize(logpath))
+    return exitcode, time.time() - start
+
+
+def drawupdates(commands: dict, status: dict, started: dict, results: dict, redraw: bool):
+    colors = {"waiting": "\033[90m", "running": "\033[33;1m", "done": "\033[32;1m", "failed": "\033[31;1m"}
+
+    if redraw:
+        print(f"\033[{len(commands)}F", end="")
+
+    for i in commands:
+        if i in results:
+            elapsed = f"{results[i][1]:.1f}s"
+        elif i in started:
+            elapsed = f"{time.time() - started[i]:.1f}s"
+        else:
+            elapsed = ""
+        print(f"\033[2K\033[34;1m{i[0].upper() + i[1:].lower():<12}\033[0m{colors[status[i]]}{status[i]:<9}\033[0m{elapsed}")
+
+    sys.stdout.flush()
+
+
+def runupdates(commands: dict, action: str = "update", finished=None, exclusive: bool = True):
+    # exclusive=False drops the lock groups and dependencies, for work that doesn't touch what's installed
+    os.makedirs(spkgpath("logs"), exist_ok=True)
+    groups = {i: n for n in range(len(updategroups)) for i in updategroups[n]} if exclusive else {}
+    dependencies = updatedependencies if exclusive else {}
+    verb = action[0].upper() + action[1:].removesuffix("e")
+    live = sys.stdout.isatty()
+
+    status = {i: "waiting" for i in commands}
+    started = {}
+    results = {}
+    running = {}
+
+    if live:
+        drawupdates(commands, status, started, results, False)
+
+    with ThreadPoolExecutor(max_workers=max(1, updateworkers)) as pool:
+        while len(results) < len(commands):
+            for i in commands:
+                if status[i] != "waiting" or len(running) >= updateworkers:
+                    continue
+                if any(j in commands and j not in results for j in dependencies.get(i, [])):
+                    continue
+                if i in groups and any(groups.get(j) == groups[i] for j in running.values()):
+                    continue
+
+                status[i] = "running"
+                started[i] = time.time()
+                running[pool.submit(runupdate, commands[i], spkgpath(f"logs/{action}-{i}.log"), f"{action} {i}")] = i
+
+                if not live:
+                    print(f"{verb}ing \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m", flush=True)
+
+            done, pending = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                i = running.pop(future)
+                results[i] = future.result()
+                status[i] = {True: "done", False: "failed"}[results[i][0] == 0]
+
+                if finished is not None:
+                    finished(i, results[i][0])
+
+                if not live:
+                    print(f"{verb}ed \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m: " + {True: "\033[32;1mDone\033[0m", False: "\033[31;1mFailed\033[0m"}[results[i][0] == 0], flush=True)
+
+            if live:
+                drawupdates(commands, status, started, results, True)
+
+    print(f"\n\033[1m{'Manager':<12}{'Duration':>10}{'Exit code':>11}  Log\033[0m")
+    for i in commands:
+        print(f"\033[34;1m{i[0].upper() + i[1:].lower():<12}\033[0m{results[i][1]:>9.1f}s{results[i][0]:>11}  {spkgpath(f"logs/{action}-{i}.log")}")
+
+    return results
+
+
+def parseaptupgradable(output: str):
+    packages = []
+    for line in output.splitlines():
+        match = re.match(r"([^/\s]+)/\S+ (\S+) \S+ \[upgradable from: ([^\]]+)\]", line)
+        if match:
+            packages.append((match.group(1), match.group(3), match.group(2)))
+    return packages
+
+
+def parsecheckupdate(output: str):
+    packages = []
+    for line in output.splitlines():
+        columns = line.split()
+        if len(columns) == 3 and "." in columns[0] and not line.startswith(("Last metadata", "Obsoleting")):
+            packages.append((columns[0].rsplit(".", 1)[0], "", columns[1]))
+    return packages
+
+
+def parsearrows(output: str):
+    return [(line.split()[0], line.split()[1], line.split()[3]) for line in output.splitlines() if len(line.split()) >= 4 and line.split()[2] == "->"]
+
+
+def parseflatpakupdates(output: str):
+    return [(line.split("\t")[0], "", line.split("\t")[1] if "\t" in line else "") for line in output.splitlines() if line.strip()]
+
+
+def parsesnaprefresh(output: str):
+    return [(line.split()[0], "", line.split()[1]) for line in output.splitlines()[1:] if len(line.split()) >= 2]
+
+
+def parsebrewoutdated(key: str):
+    def parse(output: str):
+        return [(item["name"], ", ".join(item.get("installed_versions", [])), item.get("current_version", "")) for item in json.loads(output).get(key, [])]
+    return parse
+
+
+def parsenpmoutdated(output: str):
+    return [(name, info.get("current", ""), info.get("latest", "")) for name, info in json.loads(output or "{}").items()]
+
+
+def parsepipoutdated(output: str):
+    return [(item["name"], item.get("version", ""), item.get("latest_version", "")) for item in json.loads(output)]
+
+
+def parsegemoutdated(output: str):
+    packages = []
+    for line in output.splitlines():
+        match = re.match(r"(\S+) \((\S+) < (\S+)\)", line)
+        if match:
+            packages.append(match.groups())
+    return packages
+
+
+def parsezypperupdates(output: str):
+    packages = []
+    for line in output.splitlines():
+        columns = [column.strip() for column in line.split("|")]
+        if len(columns) >= 5 and columns[0] == "v":
+            packages.append((columns[2], columns[3], columns[4]))
+    return packages
+
+
+def parsechocooutdated(output: str):
+    return [tuple(line.split("|")[:3]) for line in output.splitlines() if line.count("|") >= 3]
+
+
+# How to ask each package manager for its pending upgrades, as (name, installed version, available version). Many of them exit
+# non-zero when something is outdated (dnf check-update with 100, npm outdated with 1), so a failing exit code only means the
+# package manager couldn't tell when it printed nothing
+outdatedcommands = {
+    "apt": ["apt list --upgradable", parseaptupgradable],
+    "dnf": ["dnf check-update -q", parsecheckupdate],
+    "pacman": ["pacman -Qu", parsearrows],
+    "flatpak": ["flatpak remote-ls --updates --columns=application,version", parseflatpakupdates],
+    "snap": ["snap refresh --list", parsesnaprefresh],
+    "homebrew": ["brew outdated --formula --json=v2", parsebrewoutdated("formulae")],
+    "brewcask": ["brew outdated --cask --json=v2", parsebrewoutdated("casks")],
+    "npm": ["npm outdated -g --json", parsenpmoutdated],
+    "pip": ["pip list --outdated --format=json", parsepipoutdated],
+    "gem": ["gem outdated", parsegemoutdated],
+    "zypper": ["zypper -q list-updates", parsezypperupdates],
+    "chocolatey": ["choco outdated -r", parsechocooutdated]
+}
+
+# Exit codes that mean nothing is outdated when the package manager prints nothing
+uptodatecodes = {
+    "pacman": [1]
+}
+
+
+def outdatedpackages(managers: list[str], report: bool = True):
+    # Gives {manager: [(name, installed, available)]}, None for package managers that can't tell or didn't answer
+    try:
+        cache = readjson(spkgpath("outdated.json")) if usecache else {}
+    except (FileNotFoundError, ValueError):
+        cache = {}
+
+    results = {}
+    commands = {}
+
+    for i in managers:
+        entry = cache.get(i)
+        if i not in outdatedcommands:
+            results[i] = None
+        elif entry is not None and time.time() - entry["time"] <= outdatedttl and entry["fingerprint"] is not None and entry["fingerprint"] == fingerprint(i):
+            results[i] = [tuple(package) for package in entry["packages"]]
+        else:
+            commands[i] = outdatedcommands[i][0]
+
+    if commands and report:
+        print("Checking " + ", ".join(f"\033[34;1m{i[0].upper() + i[1:].lower()}\033[0m" for i in commands) + " for upgrades", flush=True)
+
+    for i, out in runconcurrently(commands, searchworkers, listtimeout):
+        try:
+            if out is None or (not out.stdout.strip() and out.returncode not in [0] + uptodatecodes.get(i, [])):
+                results[i] = None # Timed out, or failed (not installed, no network, no permission) without listing anything
+            else:
+                results[i] = [tuple(package) for package in outdatedcommands[i][1](out.stdout)]
+        except (ValueError, KeyError, IndexError, AttributeError, TypeError):
+            results[i] = None
+
+        if results[i] is not None:
+            cache[i] = {"time": time.time(), "fingerprint": fingerprint(i), "packages": results[i]}
+
+    if commands:
+        writeatomic(spkgpath("outdated.json"), json.dumps(cache))
+
+    return {i: results[i] for i in managers}
+
+
+def showoutdated(asjson: bool):
+    results = outdatedpackages(detectedmanagers(), not asjson)
+
+    if asjson:
+        print(json.dumps({i: None if packages is None else [{"name": package[0], "installed": package[1], "available": package[2]} for package in packages] for i, packages in results.items()}, indent=True))
+        return
+
+    rows = [(i,) + package for i, packages in results.items() if packages for package in packages]
+
+    if rows:
+        width = max(len(row[1]) for row in rows + [("", "Name")]) + 2
+        print(f"\n\033[1m{'Manager':<12}{'Name':<{width}}{'Installed':<20}Available\033[0m")
+        for i, name, installed, available in rows:
+            print(f"\033[34;1m{i[0].upper() + i[1:].lower():<12}\033[0m{name:<{width}}{installed[:19]:<20}\033[32;1m{available}\033[0m")
+
+    print()
+    for i, packages in results.items():
+        answer = {True: "\033[33;1mCan't tell\033[0m", False: {True: "\033[32;1mUp to date\033[0m", False: f"\033[1m{len(packages or [])} outdated\033[0m"}[not packages]}[packages is None]
+        print(f"\033[34;1m{i[0].upper() + i[1:].lower():<12}\033[0m{answer}")
+
+
+def update(packagemanagerflags: list[str], onlyoutdated: bool = False, prefetch: bool = False):
     commands = {
         "apt": "sudo apt update && sudo apt upgrade -y",  # Update command for APT
         "dnf": "sudo dnf update -y",                     # Update command for DNF
-        "pacman": "sudo pacman -Syu",                     # Update command for Pacman
+        "pacman": "sudo pacman -Syu --noconfirm",         # Update command for Pacman
         "flatpak": "flatpak update -y",                   # Update command for Flatpak
         "snap": "sudo snap refresh",                      # Update command for Snap
         "homebrew": "brew update && brew upgrade",        # Update command for Homebrew
@@ -461,7 +2514,7 @@ def update(packagemanagerflags: list[str]):
         "npm": "npm update -g",                           # Update command for NPM
         "pip": "pip install --upgrade <package-name>",    # Update command for Pip
         "gem": "gem update",                              # Update command for Gem
-        "conda": "conda update --all",                    # Update command for Conda
+        "conda": "conda update --all -y",                 # Update command for Conda
         "cargo": "cargo update",                          # Update command for Cargo
         "yarn": "yarn upgrade",                           # Update command for Yarn
         "composer": "composer update",                    # Update command for Composer
@@ -477,21 +2530,48 @@ def update(packagemanagerflags: list[str]):
 
     toupdate = flagstopackage(packagemanagerflags)
 
+    if onlyoutdated:
+        # Package managers that can't tell are updated anyway
+        pending = outdatedpackages(toupdate)
+        for i in [i for i in toupdate if pending[i] == []]:
+            print(f"Skipping \033[34;1m{i[0].upper() + i[1:].lower()}\033[0m: \033[32;1mUp to date\033[0m")
+            toupdate.remove(i)
+
+        if not toupdate:
+            return
+
     out = "Updating "
     for i in toupdate:
         out += f"\033[34;1m{i}\033[0m, "
 
     print(out[:-2])    
 
-    for i in toupdate:
-        os.system(commands[i])
+    # Only the selected package managers that can download without installing have a prefetch phase
+    prefetches = {i: prefetchcommands[i] for i in toupdate if i in prefetchcommands} if prefetch else {}
+
+    if prefetches:
+        # Downloads don't change what's installed, so even package managers sharing a lock group may fetch at the same time
+        start = time.time()
+        runupdates(prefetches, "prefetch", exclusive=False)
+        prefetched = time.time() - start
+
+    start = time.time()
+    runupdates({i: commands[i] for i in toupdate})
+
+    if prefetches:
+        print(f"\nDownloading took \033[1m{prefetched:.1f}s\033[0m, installing took \033[1m{time.time() - start:.1f}s\033[0m")
+
+    invalidatesearchcache(toupdate)
+
+    try:
+        cache = readjson(spkgpath("outdated.json"))
+        writeatomic(spkgpath("outdated.json"), json.dumps({i: entry for i, entry in cache.items() if i not in toupdate}))
+    except (FileNotFoundError, ValueError):
+        pass
 
 
 def show(package):
-    if os.name == "posix":
-        installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-    elif os.name == "nt":
-        installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
+    manager = inventoryget(package)
 
     commands = {
         "apt": "apt show ",
@@ -520,58 +2600,36 @@ def show(package):
         "espm": "sudo espm show "
     }
     
-    if package in list(installedpackages.keys()):
-        manager = installedpackages[package]
+    if manager is not None:
         print(f"\033[0mShowing from \033[34;1m{manager[0].upper() + manager[1:].lower()}\033[0m")
         time.sleep(0.1)
-        os.system(commands[manager] + package)
+        system(commands[manager] + package, f"show {manager}")
 
     else:
         print(f"\033[31;1mError:\033[0m Package {package} not found")
 
 
 def detach(packages: list[str]):
-    if os.name == "posix":
-        installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-    elif os.name == "nt":
-        installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
-
     out = ""
     for i in packages:
         out += "\033[33;1m" + i + "\033[0m, "
 
     choice = {"y": True, "n": False}[input(f"Are you sure you want to \033[31mdetach\033[0m {out[:-2]}? (y/n) :  ")[0].lower()]
 
-    try:
-        if choice:
-            for package in packages:
-                del installedpackages[package]
-                print(f"Successfully detached \033[34;1m\"{package}\"\033[0m")
-        else:
-            sys.exit()
-    except KeyError:
-        print(f"\033[31;1mError:\033[0m Package \"{package}\" was not found")
+    if not choice:
         sys.exit()
 
-    if os.name == "posix":
-        open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
-    elif os.name == "nt":
-        open(f"{os.getenv("APPDATA")}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
-
+    for package in packages:
+        if inventoryget(package) is None:
+            print(f"\033[31;1mError:\033[0m Package \"{package}\" was not found")
+            sys.exit()
+        print(f"Successfully detached \033[34;1m\"{package}\"\033[0m")
 
-def attach(packages: list[str], manager: str):
-    if os.name == "posix":
-        installedpackages = json.loads(open(f"{os.path.expanduser('~')}/spkg/installed.json", "r").read())
-    elif os.name == "nt":
-        installedpackages = json.loads(open(f"{os.getenv("APPDATA")}/spkg/installed.json", "r").read())
+    inventoryremove(packages)
 
-    for i in packages:
-        installedpackages[i] = flagstopackage([manager])[0]
 
-    if os.name == "posix":
-        open(f"{os.path.expanduser('~')}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
-    elif os.name == "nt":
-        open(f"{os.getenv("APPDATA")}/spkg/installed.json", "w").write(json.dumps(installedpackages, indent=True))
+def attach(packages: list[str], manager: str):
+    inventoryset({i: flagstopackage([manager])[0] for i in packages})
 
 
     out = ""
@@ -582,35 +2640,432 @@ def attach(packages: list[str], manager: str):
     print(f"Successfully attached \"{out[:-2]}\"")
 
 
+def openfleet():
+    os.makedirs(os.path.dirname(spkgpath("fleet.db")), exist_ok=True)
+    fleet = sqlite3.connect(spkgpath("fleet.db"), timeout=30)
+    fleet.execute("PRAGMA journal_mode=WAL")
+    fleet.execute("CREATE TABLE IF NOT EXISTS packages (host TEXT, name TEXT, manager TEXT, version TEXT)")
+    fleet.execute("CREATE INDEX IF NOT EXISTS packages_name ON packages (name, manager)")
+    fleet.execute("CREATE INDEX IF NOT EXISTS packages_host ON packages (host)")
+    fleet.execute("CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, time REAL, status TEXT, amount INTEGER)")
+    return fleet
+
+
+def fleetscan(hostsfile: str, scan: bool = True):
+    hosts = list(dict.fromkeys(line.split("#")[0].strip() for line in open(hostsfile, "r") if line.split("#")[0].strip()))
+
+    remote = {True: "spkg scan </dev/null >/dev/null 2>&1; spkg export -", False: "spkg export -"}[scan]
+    commands = {host: fleetcommand.format(host=shlex.quote(host), command=shlex.quote(remote)) for host in hosts}
+
+    print(f"Collecting the inventories of \033[1m{len(hosts)} hosts\033[0m")
+    failed = 0
+
+    with openfleet() as fleet:
+        for host, out in runconcurrently(commands, fleetworkers, fleettimeout):
+            if out is None:
+                status = "timed out"
+            elif out.returncode != 0:
+                status = f"failed ({out.returncode})"
+            else:
+                try:
+                    packages = json.loads(out.stdout)["packages"]
+                    status = "ok"
+                except (ValueError, KeyError, TypeError):
+                    status = "unreadable"
+
+            if status != "ok":
+                failed += 1
+                fleet.execute("INSERT INTO hosts VALUES (?, ?, ?, NULL) ON CONFLICT (host) DO UPDATE SET status = excluded.status", [host, time.time(), status])
+                fleet.commit()
+                print(f"Host \033[1m{host}\033[0m: \033[31;1m{status[0].upper() + status[1:]}\033[0m", flush=True)
+                continue
+
+            # Each host's rows are swapped as soon as it answers, so one slow host doesn't hold back the rest
+            fleet.execute("DELETE FROM packages WHERE host = ?", [host])
+            fleet.executemany("INSERT INTO packages VALUES (?, ?, ?, ?)", [(host, package["name"], package["manager"], package.get("version", "")) for package in packages])
+            fleet.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?)", [host, time.time(), status, len(packages)])
+            fleet.commit()
+            print(f"Host \033[1m{host}\033[0m: \033[32;1m{len(packages)} packages\033[0m", flush=True)
+
+    print(f"Collected \033[1m{len(hosts) - failed} hosts\033[0m into fleet.db" + (f", \033[31;1m{failed} failed\033[0m (they keep their last inventory)" if failed else ""))
+
+
+def fleetquery(package: str, manager: str | None, asjson: bool):
+    with openfleet() as fleet:
+        if manager is None:
+            rows = fleet.execute("SELECT host, manager, version FROM packages WHERE name = ? ORDER BY host", [package]).fetchall()
+        else:
+            rows = fleet.execute("SELECT host, manager, version FROM packages WHERE name = ? AND manager = ? ORDER BY host", [package, manager]).fetchall()
+        hosts = fleet.execute("SELECT COUNT(*) FROM hosts WHERE amount IS NOT NULL").fetchone()[0]
+
+    if asjson:
+        print(json.dumps([{"host": host, "manager": manager, "version": version} for host, manager, version in rows], indent=True))
+        return
+
+    if not rows:
+        print(f"\033[31;1mError:\033[0m None of the {hosts} hosts have \"{package}\"" + (f" from {manager}" if manager else ""))
+        return
+
+    width = max(len(row[0]) for row in rows + [("Host",)]) + 2
+    print(f"\033[1m{'Host':<{width}}{'Manager':<12}Version\033[0m")
+    for host, manager, version in rows:
+        print(f"{host:<{width}}\033[34;1m{manager[0].upper() + manager[1:].lower():<12}\033[0m{version}")
+    print(f"\033[1m{len({row[0] for row in rows})} of {hosts} hosts\033[0m have \"{package}\"")
+
+
+# What the completion scripts offer. Shells ask on every key press, so commands and choices are answered by the shell itself and
+# package names by completionhelper, never by starting SPKG
+completioncommands = ["install", "uninstall", "search", "scan", "index", "daemon", "fleet", "export", "restore", "convert", "diff", "outdated", "version", "update", "show", "detach", "attach", "completion", "help"]
+completionchoices = {
+    "completion": ["bash", "zsh", "fish"],
+    "daemon": ["status", "stop"],
+    "fleet": ["scan", "query"],
+    "update": ["-all", "-installed", "-apt", "-dnf", "-pac", "-flat", "-snap", "-brew", "-win", "-choco", "-scoop", "-npm", "-pip", "-gem", "-conda", "-cargo", "-yarn", "-comp", "-brewcask", "-mvn", "-spack", "-guix", "-slack", "-zypper", "-portage", "-espm", "--only-outdated", "--prefetch"]
+}
+completionnames = {"install": "names-available.txt", "search": "names-available.txt", "uninstall": "names-installed.txt", "show": "names-installed.txt", "detach": "names-installed.txt"}
+
+# Prints the names in a sorted name file (see writenames) that start with a prefix, by binary search over the memory mapped file.
+# Embedded in the completion scripts in single quotes, so it mustn't contain any
+completionhelper = """import mmap, sys
+key = sys.argv[2].encode()
+try:
+    file = open(sys.argv[1], "rb")
+    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+except (OSError, ValueError):
+    sys.exit()
+low, high = 0, len(data)
+while low < high:
+    start = max(low, data.rfind(b"\\n", 0, (low + high) // 2) + 1)
+    end = data.find(b"\\n", start)
+    end = len(data) if end == -1 else end
+    if data[start:end] < key:
+        low = end + 1
+    else:
+        high = start
+found = []
+while low < len(data) and len(found) < 200:
+    end = data.find(b"\\n", low)
+    end = len(data) if end == -1 else end
+    if not data[low:end].startswith(key):
+        break
+    found.append(data[low:end].decode(errors="replace"))
+    low = end + 1
+if found:
+    print("\\n".join(found))"""
+
+
+def completionscript(shell: str):
+    helper = f"python3 -I -S -c '{completionhelper}'"
+    commands = " ".join(completioncommands)
+
+    if shell == "bash":
+        cases = "".join(f"""
+        {command}) COMPREPLY=($(compgen -W "{" ".join(choices)}" -- "$cur"));;""" for command, choices in completionchoices.items())
+        names = "".join(f"""
+        {command}) [[ $cur == -* ]] || mapfile -t COMPREPLY < <(_spkg_names {filename} "$cur");;""" for command, filename in completionnames.items())
+        return f"""_spkg_names() {{
+    {helper} "$HOME/spkg/$1" "$2"
+}}
+_spkg() {{
+    local cur=${{COMP_WORDS[COMP_CWORD]}}
+    COMPREPLY=()
+    if (( COMP_CWORD == 1 )); then
+        COMPREPLY=($(compgen -W "{commands}" -- "$cur"))
+        return
+    fi
+    case ${{COMP_WORDS[1]}} in{cases}{names}
+    esac
+}}
+complete -o default -F _spkg spkg"""
+
+    if shell == "zsh":
+        cases = "".join(f"""
+            {command}) candidates=({" ".join(choices)});;""" for command, choices in completionchoices.items())
+        names = "".join(f"""
+            {command}) [[ $PREFIX == -* ]] || candidates=(${{(f)$(_spkg_names {filename} "$PREFIX")}});;""" for command, filename in completionnames.items())
+        return f"""#compdef spkg
+_spkg_names() {{
+    {helper} "$HOME/spkg/$1" "$2"
+}}
+_spkg() {{
+    local -a candidates
+    if (( CURRENT == 2 )); then
+        candidates=({commands})
+    else
+        case $words[2] in{cases}{names}
+        esac
+    fi
+    compadd -a candidates
+}}
+compdef _spkg spkg"""
+
+    lines = [f"""function __spkg_names
+    set -l prefix (commandline -ct)
+    string match -q -- '-*' "$prefix"; or {helper} ~/spkg/$argv[1] "$prefix"
+end""", f"complete -c spkg -f -n __fish_use_subcommand -a '{commands}'"]
+    lines += [f"complete -c spkg -f -n '__fish_seen_subcommand_from {command}' -a '{" ".join(choices)}'" for command, choices in completionchoices.items()]
+    lines += [f"complete -c spkg -f -n '__fish_seen_subcommand_from {command}' -a '(__spkg_names {filename})'" for command, filename in completionnames.items()]
+    return "\n".join(lines)
+
+
+def daemonrequest(request: dict, timeout: float = 1):
+    if indaemon or os.name != "posix" or not os.path.exists(spkgpath("spkg.sock")):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(spkgpath("spkg.sock"))
+            client.sendall(json.dumps(request).encode() + b"\n")
+
+            response = b""
+            while not response.endswith(b"\n"):
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+
+        return json.loads(response)
+    except (OSError, ValueError):
+        return None # No daemon running (or it didn't answer in time), so the caller does the work itself
+
+
+def diskstamp():
+    stamps = []
+    for filename in ("managers.json", "inventory.db", "inventory.db-wal"):
+        try:
+            stamps.append(os.stat(spkgpath(filename)).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def daemon():
+    global indaemon
+
+    if os.name != "posix":
+        print("\033[31;1mError:\033[0m The daemon needs Unix sockets, which aren't available on this system")
+        sys.exit()
+
+    if daemonrequest({"op": "ping"}) is not None:
+        print("\033[31;1mError:\033[0m A daemon is already running")
+        sys.exit()
+
+    indaemon = True
+    lock = threading.Lock()
+    state = {"stamp": None, "managers": {}, "inventory": {}, "fingerprints": {}, "searches": {}, "reloaded": 0}
+
+    def reload():
+        try:
+            managers = readjson(spkgpath("managers.json"))
+        except (FileNotFoundError, ValueError):
+            managers = {"packages": {}, "installed": []}
+
+        ensureinventory(managers["installed"])
+        inventory = inventoryload()
+
+        with lock:
+            state.update(stamp=diskstamp(), managers=managers, inventory=inventory, reloaded=time.time())
+            for key in [key for key, entry in state["searches"].items() if time.time() - entry[0] > cachettl]:
+                del state["searches"][key]
+
+    def refresh():
+        while True:
+            time.sleep(5)
+
+            if diskstamp() != state["stamp"] or time.time() - state["reloaded"] > daemoninterval:
+                reload()
+
+            for manager in state["managers"]["installed"]:
+                current = fingerprint(manager)
+                if current is None or state["fingerprints"].get(manager) == current:
+                    continue
+
+                if manager in state["fingerprints"] and ensureinventory([manager]):
+                    with lock:
+                        for key in [key for key in state["searches"] if key[0] == manager]:
+                            del state["searches"][key]
+                    reload()
+
+                state["fingerprints"][manager] = current
+
+    def search(package: str, timeout: float, mode: str, cachelife: float, indexlife: float):
+        # Answers with the client's search mode and TTLs rather than the ones the daemon was started with
+        with lock:
+            installed = list(state["managers"]["installed"])
+            known = {i: state["searches"].get((i, package, mode)) for i in installed}
+
+        if all(entry is not None and time.time() - entry[0] <= cachelife for entry in known.values()):
+            return {i: known[i][1] for i in installed}, [record for i in installed for record in known[i][2]]
+
+        answers = {}
+        records = {}
+        searchpackages([package], lambda manager, package, result, source, packages: answers.__setitem__(manager, result), timeout, records, mode=mode, cachelife=cachelife, indexlife=indexlife)
+
+        with lock:
+            for i, result in answers.items():
+                if result is not None:
+                    state["searches"][(i, package, mode)] = (time.time(), result, [record for record in records[package] if record[3] == i])
+
+        return {i: answers.get(i) for i in installed}, records[package]
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+
+            if diskstamp() != state["stamp"]:
+                reload()
+
+            if request["op"] == "search":
+                results, records = search(request["package"], request.get("timeout", searchtimeout), request.get("mode", searchmode), request.get("cachettl", cachettl), request.get("indexttl", indexttl))
+                response = {"results": results, "records": records}
+            elif request["op"] == "inventory":
+                response = {"manager": state["inventory"].get(request["package"])}
+            elif request["op"] == "managers":
+                response = {"managers": state["managers"]}
+            elif request["op"] == "invalidate":
+                with lock:
+                    for key in [key for key in state["searches"] if key[0] in request["managers"]]:
+                        del state["searches"][key]
+                response = {}
+            elif request["op"] == "stop":
+                threading.Thread(target=server.shutdown).start()
+                response = {}
+            else:
+                response = {"pid": os.getpid(), "packages": len(state["inventory"]), "searches": len(state["searches"])}
+
+            try:
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+            except BrokenPipeError:
+                pass # The client gave up waiting and is doing the work itself
+
+    reload()
+    for manager in state["managers"]["installed"]:
+        state["fingerprints"][manager] = fingerprint(manager)
+
+    if os.path.exists(spkgpath("spkg.sock")):
+        os.remove(spkgpath("spkg.sock")) # Left behind by a daemon that didn't shut down cleanly
+
+    server = socketserver.ThreadingUnixStreamServer(spkgpath("spkg.sock"), Handler)
+    server.daemon_threads = True
+    os.chmod(spkgpath("spkg.sock"), 0o600)
+    threading.Thread(target=refresh, daemon=True).start()
+
+    print(f"\033[34;1mSPKG\033[0m daemon listening on \033[1m{spkgpath("spkg.sock")}\033[0m with \033[1m{len(state["inventory"])} packages\033[0m")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(spkgpath("spkg.sock"))
+
+
 if __name__ == "__main__":
     global version
     version = "0.1.2"
     try:
         args = sys.argv[1:]
 
+        tracing = popflag(args, "--trace")
+        if tracing:
+            atexit.register(writetrace)
+
+        metricsfile = popoption(args, "--metrics", metricsfile)
+        if metricsfile and args[0] in ("scan", "search", "install", "update"):
+            atexit.register(writemetrics, args[0])
+
+        jobs = popoption(args, "--jobs")
+        if jobs is not None:
+            searchworkers = updateworkers = fleetworkers = int(jobs)
+        timeout = popoption(args, "--timeout")
+        if timeout is not None:
+            searchtimeout = fleettimeout = float(timeout)
+        usecache = not popflag(args, "--no-cache")
+        cachettl = float(popoption(args, "--cache-ttl", cachettl))
+        cachesize = int(popoption(args, "--cache-size", cachesize))
+        indexttl = float(popoption(args, "--index-ttl", indexttl))
+        searchmode = {True: "exact", False: {True: "prefix", False: "text"}[popflag(args, "--prefix")]}[popflag(args, "--exact")]
+
         if args[0] == "install":
-            args = args[1:]
-            for i in args:
-                installpackage(i)
-        
+            yes = popflag(args, "--yes")
+            prefer = popoption(args, "--prefer")
+            installpackages(args[1:], yes, prefer.split(",") if prefer else None)
+
         elif args[0] == "uninstall":
-            args = args[1:]
-            for i in args:
-                removepackage(i)
+            removepackages(args[1:])
         
         elif args[0] == "search":
-            args = args[1:]
-            for i in args:   
-                searchpackage(i)
+            searchlimit = int(popoption(args, "--limit", searchlimit))
+            searchjson = popflag(args, "--json")
+            batch = popoption(args, "--batch")
+            if batch is not None:
+                showbatch(batch, popflag(args, "--csv"))
+            else:
+                showsearch(args[1:])
     
         elif args[0] == "scan":
-            findmanagers()
+            findmanagers(popflag(args, "--full"))
+
+        elif args[0] == "index":
+            buildindex()
+
+        elif args[0] == "daemon":
+            daemoninterval = float(popoption(args, "--interval", daemoninterval))
+
+            if args[1:] == ["stop"]:
+                print({True: "Daemon stopped", False: "No daemon running"}[daemonrequest({"op": "stop"}) is not None])
+            elif args[1:] == ["status"]:
+                status = daemonrequest({"op": "ping"})
+                if status is None:
+                    print("No daemon running")
+                else:
+                    print(f"Daemon running (pid {status["pid"]}) with \033[1m{status["packages"]} packages\033[0m and \033[1m{status["searches"]} search results\033[0m in memory")
+            else:
+                daemon()
+
+        elif args[0] == "fleet":
+            fleetcommand = popoption(args, "--remote", fleetcommand)
+            hostsfile = popoption(args, "--hosts", "hosts.txt")
+            scan = not popflag(args, "--no-scan")
+            manager = popoption(args, "--manager")
+            asjson = popflag(args, "--json")
+            if args[1:2] == ["scan"]:
+                fleetscan(hostsfile, scan)
+            elif args[1:2] == ["query"] and len(args) > 2:
+                fleetquery(args[2], manager, asjson)
+            else:
+                print("\033[31;1mError:\033[0m Use \"spkg fleet scan --hosts <file>\" or \"spkg fleet query <package>\"")
+
+        elif args[0] == "export":
+            exportpackages(args[1] if len(args) > 1 else "spkg.lock")
+
+        elif args[0] == "restore":
+            latest = popflag(args, "--latest")
+            restorepackages(args[1] if len(args) > 1 else "spkg.lock", not latest)
+
+        elif args[0] == "convert":
+            convertinventory(args[1], args[2])
+
+        elif args[0] == "completion":
+            print(completionscript(args[1]))
+
+        elif args[0] == "diff":
+            asjson = popflag(args, "--json")
+            showdiff(args[1:], asjson)
 
         elif args[0] == "version":
             print(f"\033[34;1mSPKG\033[0m version {version}")
 
         elif args[0] == "update":
-            update(args[1:])
+            onlyoutdated = popflag(args, "--only-outdated")
+            prefetch = popflag(args, "--prefetch")
+            update(args[1:], onlyoutdated, prefetch)
+
+        elif args[0] == "outdated":
+            asjson = popflag(args, "--json")
+            showoutdated(asjson)
 
         elif args[0] == "show":
             args = args[1:]
@@ -630,21 +3085,111 @@ install: Installs a package. Requires sudo privileges on Unix and admin on Windo
     > sudo spkg install <package>
 
     When executed, install will look through all your package managers to try to find a match and then ask you which one to install.
+    Several packages can be given at once. They're searched for together and every package manager is run once with all the
+    packages chosen for it.
+
+    > sudo spkg install --yes [--prefer=apt,flatpak,pip] <package>
+    Installs without asking anything. The package managers are searched at the same time and the first one in the --prefer
+    order that has a package of exactly that name is used; searches still running for package managers after it are stopped.
+    Without --prefer the package managers that were installed with most often come first, then the ones that answer
+    searches quickest (learned in ranking.json).
 
 
 uninstall: Uninstalls a package. Requires sudo privileges on Unix and admin on Windows. Requires a package name.
     > sudo spkg uninstall <package>
 
-    When executed, uninstall will delete the package with the correct package manager for you
+    When executed, uninstall will delete the package with the correct package manager for you. Several packages can be given at once,
+    every package manager is then run once with all of its packages.
 
 
 search: Searches through all package managers to find a match for you. Requires sudo privileges on Unix
     > sudo spkg search <package>
 
+    The package managers are searched at the same time. --jobs=<n> limits how many run at once (default 8) and
+    --timeout=<seconds> sets how long each one gets before it's reported as timed out (default 30). Both also apply to install.
+
+    Afterwards the best matches are shown with their version, package manager and summary: exact names first, then names
+    starting with the search term, then the closest names. --limit=<n> changes how many are shown (default 10) and --json
+    prints them as JSON instead.
+
+    Results are cached in searchcache.json for an hour (--cache-ttl=<seconds>), keeping the 512 most recently used results
+    (--cache-size=<n>). Use --no-cache to always ask the package managers. Installing, uninstalling and updating
+    clears the cached results of the package managers involved.
+
+    > sudo spkg search --batch <file|-> [--csv]
+    Checks every name listed in the file (or read from standard input) at once and prints which package managers have a
+    package of exactly that name, as JSON or as a CSV matrix. Up to 200 names are asked per call where the package manager
+    can look up many at once (APT, Pacman, DNF, Zypper, Snap, Flatpak), the others are searched name by name.
+
+
+index: Downloads the full list of available packages from every package manager that can list it in bulk (APT, DNF, Pacman,
+Flatpak, Homebrew, Brew cask, Gem, Spack and GUIX) into index.db, so searches don't have to ask them live. Requires sudo privileges on Unix.
+    > sudo spkg index
+
+    Searches answer from the index as long as it's younger than a day (--index-ttl=<seconds>). By default a package matches if
+    its name or description contains the search term, --prefix only matches names starting with it and --exact only exact names.
+
 
 scan: Updates the list of known package managers. Required sudo privileges on Unix. Has to be run on install of SPKG or any other package managers.
     > sudo spkg scan
 
+    Package managers whose package database hasn't changed since the last scan aren't listed again. Use --full to list all of them.
+    Without a scan, install, uninstall, show and restore list the installed packages of a package manager the first time they
+    need them, and again once its package database changes.
+
+
+daemon: Keeps the package managers, the inventory and recent search results in memory and answers search, show, install and
+uninstall lookups over a Unix socket (spkg.sock) instead of every command starting cold. Commands fall back to working on
+their own when no daemon is running. The daemon notices installs, uninstalls and package database changes by itself and
+reloads everything every 5 minutes (--interval=<seconds>). Not available on Windows.
+    > sudo spkg daemon
+    > sudo spkg daemon status
+    > sudo spkg daemon stop
+
+
+fleet: Scans many hosts at the same time and collects their inventories into fleet.db. The hosts file lists one host per line.
+Every host runs "spkg scan" and "spkg export -" over ssh (--remote="<command>" replaces "ssh -o BatchMode=yes {host} {command}"),
+16 hosts at once (--jobs=<n>), each getting 10 minutes (--timeout=<seconds>). --no-scan only collects the current inventories.
+Hosts that fail keep the inventory from their last successful scan.
+    > spkg fleet scan --hosts <file> [--no-scan]
+    > spkg fleet query <package> [--manager=<manager>] [--json]
+
+
+export: Writes every package in the inventory with its package manager and version to a lockfile (spkg.lock by default,
+- for standard output).
+    > spkg export [lockfile]
+
+
+restore: Installs everything in a lockfile without asking. Requires sudo privileges on Unix and admin on Windows. Packages the
+inventory already has are skipped, every package manager installs all of its packages at once and independent package
+managers run at the same time. Versions are pinned where the package manager allows it, --latest installs the newest
+versions instead. Progress is kept in restore.json, so running an interrupted or failed restore again only redoes the
+package managers that didn't finish.
+    > sudo spkg restore [lockfile] [--latest]
+
+
+convert: Converts an inventory between JSON (the old installed.json, or a lockfile from export) and the binary format of
+inventory.bin, which SPKG rebuilds next to inventory.db whenever it lists the installed packages, so show, install,
+uninstall, attach and detach can look packages up without loading the whole inventory. After single installs and removals
+it's out of date and they read inventory.db instead, until the next listing. Targets ending in .bin are written in the binary format, anything else as JSON.
+    > spkg convert <inventory.json> <inventory.bin>
+    > spkg convert <inventory.bin> <inventory.json>
+
+
+completion: Prints a shell completion script for bash, zsh or fish. Commands, update flags and package names are completed:
+installed packages for uninstall, show and detach, and packages from the index (see index) for install and search. The
+scripts search the name lists themselves, so print them again after updating SPKG.
+    > spkg completion bash > /etc/bash_completion.d/spkg
+    > spkg completion zsh > "${fpath[1]}/_spkg"
+    > spkg completion fish > ~/.config/fish/completions/spkg.fish
+
+
+diff: Shows which packages were added, removed, upgraded or downgraded between two scans. Every scan that finds changes
+saves a numbered snapshot of all installed packages with their package manager and version in snapshots/. Without
+snapshot numbers the last two scans are compared. --json prints the changes as JSON.
+    > spkg diff
+    > spkg diff <snapshot> <snapshot> [--json]
+
 
 version: Prints the version of SPKG you're using.
     > spkg version
@@ -680,21 +3225,51 @@ update: Updates the packages you specify with flags. Requires sudo privileges an
         -zypper: Updates Zypper
         -portage: Updates Portage
 
+    Package managers that don't share a lock (like Flatpak, NPM, Cargo, Gem, PIP and Snap) are updated at the same time,
+    at most 4 at once (--jobs=<n>). System package managers (APT, DNF, Zypper, Pacman, Portage, SlackPkg, ESPM) are always
+    updated one after another. The output of every package manager is written to logs/update-<manager>.log and a summary
+    with the duration and exit code of each one is printed at the end.
+
+    --only-outdated first checks which package managers have upgrades pending (see outdated) and skips the ones that are
+    up to date.
+
+    --prefetch first downloads the upgrades of every package manager that can download without installing (APT, DNF, Pacman,
+    Flatpak, Zypper, Homebrew, Brew cask, Conda) all at the same time, then installs them from the local caches as usual and
+    prints how long each phase took. Download logs go to logs/prefetch-<manager>.log.
+
+
+outdated: Lists the upgrades every detected package manager has pending, asking them all at the same time. Answers are
+kept in outdated.json for an hour, or until the package manager's package database changes (--no-cache to always ask).
+    > spkg outdated [--json]
+
 
 show: Shows an installed package with the correct Package Manager. Requires sudo privileges on Unix
     > sudo spkg show <package>
 
 
-detach: Makes SPKG forget a package (it gets removed from the installed.json file, meaning that SPKG won't hinder you from installing stuff). Requires sudo privileges on Unix. Can take multiple packages.
+detach: Makes SPKG forget a package (it gets removed from the inventory, meaning that SPKG won't hinder you from installing stuff). Requires sudo privileges on Unix. Can take multiple packages.
     > sudo spkg detach <package>
 
 
-attach: Attaches a package to the installed.json file to show SPKG that it's installed. Requires sudo privileges on Unix. Can take multiple packages.
+attach: Attaches a package to the inventory to show SPKG that it's installed. Requires sudo privileges on Unix. Can take multiple packages.
     > sudo spkg attach <package> <package-manager>
 
 
 help: Prints a help message.
 
+
+--trace: Can be added to any command. Records how long every package manager command and every read or write of SPKG's
+files took, writes it as a Chrome trace to traces/trace-<time>.json and prints a summary with the slowest first.
+    > sudo spkg scan --trace
+
+--metrics=<file.prom>: Can be added to scan, search, install and update. Afterwards writes metrics for node_exporter's
+textfile collector: installed packages per package manager, which package managers were detected, duration and exit code of
+every package manager command, where search answers came from (cache, index, daemon or live) and when the last scan
+finished. The file is replaced atomically, so a scrape never sees half of it.
+    > sudo spkg scan --metrics=/var/lib/node_exporter/textfile_collector/spkg.prom
+
+SPKG keeps track of installed packages in inventory.db. If an older installed.json is found next to it, it's imported the first time SPKG runs.
+
 The reason all commands (except help) require sudo privileges is because the necessary data is in the /root folder. If you're on Windows, you don't need to use sudo.
             """)
     except IndexError:
@@ -0,0 +1,31 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+
+# SPKG is a single script rather than a package, so it's loaded from its path once and shared by all tests
+spec = importlib.util.spec_from_file_location("spkg", os.path.join(os.path.dirname(__file__), "..", "spkg.py"))
+spkg = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(spkg)
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture(*path: str):
+    with open(os.path.join(fixtures, *path), "r") as file:
+        return file.read()
+
+
+class SpkgTestCase(unittest.TestCase):
+    # Every test gets an empty HOME of its own, so nothing is read from or written to the real ~/spkg
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.addCleanup(self.home.cleanup)
+        self.startpatches(mock.patch.dict(os.environ, {"HOME": self.home.name}))
+
+    def startpatches(self, *patches):
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
@@ -0,0 +1,38 @@
+import unittest
+
+from spkgtest import SpkgTestCase, fixture, spkg
+
+
+class BatchParserTests(SpkgTestCase):
+    def test_aptpolicy(self):
+        # python is only known as a virtual package, so it has no candidate to install
+        self.assertEqual(spkg.parseaptpolicy(fixture("lookups", "apt-cache-policy.txt")), {"vim", "libc6:i386", "htop"})
+
+    def test_nocandidate(self):
+        self.assertEqual(spkg.parseaptpolicy("python:\n  Installed: (none)\n  Candidate: (none)\n  Version table:\n"), set())
+        self.assertEqual(spkg.parseaptpolicy(""), set())
+
+    def test_pacmaninfo(self):
+        self.assertEqual(spkg.parseinfonames(fixture("lookups", "pacman-si.txt")), {"vim", "htop"})
+
+    def test_dnfinfo(self):
+        self.assertEqual(spkg.parseinfonames(fixture("lookups", "dnf-info.txt")), {"vim-enhanced", "htop"})
+
+    def test_snapinfo(self):
+        self.assertEqual(spkg.parseinfonames(fixture("lookups", "snap-info.txt")), {"vim-editor", "nvim"})
+
+    def test_flatpakids(self):
+        names = spkg.parseflatpakids(fixture("lookups", "flatpak-remote-ls.txt"))
+        for name in ["org.mozilla.firefox", "com.valvesoftware.Steam", "org.gnome.Calculator"]:
+            self.assertIn(name, names)
+
+    def test_flatpakshortids(self):
+        names = spkg.parseflatpakids(fixture("lookups", "flatpak-remote-ls.txt"))
+        for name in ["firefox", "Steam", "Calculator"]:
+            self.assertIn(name, names)
+        self.assertNotIn("mozilla", names)
+        self.assertNotIn("steam", names)
+
+
+if __name__ == "__main__":
+    unittest.main()
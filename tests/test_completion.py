@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from spkgtest import SpkgTestCase, spkg
+
+
+class CompletionHelperTests(SpkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.names = os.path.join(self.home.name, "names.txt")
+        with open(self.names, "w") as file:
+            file.write("".join(name + "\n" for name in sorted(["vim", "vim-common", "vim-tiny", "vlc", "aptitude", "zsh"])))
+
+    def complete(self, prefix: str, names: str = None):
+        return subprocess.run([sys.executable, "-I", "-S", "-c", spkg.completionhelper, names or self.names, prefix], capture_output=True, text=True).stdout
+
+    def test_prefix(self):
+        self.assertEqual(self.complete("vim"), "vim\nvim-common\nvim-tiny\n")
+        self.assertEqual(self.complete("a"), "aptitude\n")
+        self.assertEqual(self.complete("zsh"), "zsh\n")
+        self.assertEqual(len(self.complete("").splitlines()), 6)
+
+    def test_nomatch(self):
+        self.assertEqual(self.complete("x"), "")
+        self.assertEqual(self.complete("vimz"), "")
+        self.assertEqual(self.complete("vim", os.path.join(os.path.dirname(self.names), "missing.txt")), "")
+
+    def test_scripts(self):
+        # The helper is passed to python in single quotes
+        self.assertNotIn("'", spkg.completionhelper)
+        for shell in ["bash", "zsh", "fish"]:
+            self.assertIn(spkg.completionhelper, spkg.completionscript(shell))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from unittest import mock
+
+from spkgtest import SpkgTestCase, spkg
+
+
+class InstallTests(SpkgTestCase):
+    def install(self, packages: list[str], managers: dict, statuses: dict):
+        stored = {}
+        self.startpatches(
+            mock.patch.object(spkg, "inventoryget", lambda package, managers=None: None),
+            mock.patch.object(spkg, "detectedmanagers", lambda: sorted(set(managers.values()))),
+            mock.patch.object(spkg, "racepackage", lambda package, order: managers[package]),
+            mock.patch.object(spkg, "ensureinventory", lambda managers: False),
+            mock.patch.object(spkg, "system", lambda command, label=None: statuses[command.split()[-1].split("=")[-1]]),
+            mock.patch.object(spkg, "inventoryset", stored.update),
+            mock.patch.object(spkg, "invalidatesearchcache", lambda managers: None),
+            mock.patch.object(spkg, "learnranking", lambda installs=[], latencies={}: None)
+        )
+
+        with mock.patch("builtins.print"):
+            spkg.installpackages(packages, True)
+        return stored
+
+    def test_failedbatch(self):
+        # apt installs the batch with one command, so its exit status counts for every package in it
+        self.assertEqual(self.install(["a", "b", "c"], {"a": "apt", "b": "apt", "c": "npm"}, {"b": 100, "c": 0}), {"c": "npm"})
+
+    def test_singleargument(self):
+        self.assertEqual(self.install(["a", "b"], {"a": "maven", "b": "maven"}, {"a": 1, "b": 0}), {"b": "maven"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from spkgtest import SpkgTestCase, spkg
+
+
+class InventoryCacheTests(SpkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.startpatches(
+            mock.patch.object(spkg, "daemonrequest", lambda request, timeout=None: None),
+            mock.patch.object(spkg, "ensureinventory", lambda managers: False)
+        )
+
+    def test_bulkwrite(self):
+        spkg.inventoryreplace([("vim", "9.0", "apt"), ("requests", "2.31.0", "pip")])
+
+        self.assertEqual(sorted(spkg.unpackinventory(open(spkg.spkgpath("inventory.bin"), "rb").read())), [("requests", "2.31.0", "pip"), ("vim", "9.0", "apt")])
+        self.assertEqual(spkg.lookupinventory(spkg.spkgpath("inventory.bin"), "vim", spkg.inventorychanges()), "apt")
+        self.assertEqual(spkg.inventoryget("requests", []), "pip")
+
+    def test_smallwrite(self):
+        spkg.inventoryreplace([("vim", "9.0", "apt")])
+        built = os.stat(spkg.spkgpath("inventory.bin")).st_mtime_ns
+
+        spkg.inventoryset({"htop": "apt"})
+        spkg.inventoryremove(["vim"])
+
+        self.assertEqual(os.stat(spkg.spkgpath("inventory.bin")).st_mtime_ns, built)
+        with self.assertRaises(ValueError):
+            spkg.lookupinventory(spkg.spkgpath("inventory.bin"), "vim", spkg.inventorychanges())
+        self.assertEqual(spkg.inventoryget("htop", []), "apt")
+        self.assertIsNone(spkg.inventoryget("vim", []))
+
+    def test_rolledback(self):
+        spkg.inventoryreplace([("vim", "9.0", "apt")])
+
+        # Fails the transaction at its last statement, after the new rows went in, neither inventory.db nor inventory.bin may change
+        inventory = spkg.openinventory()
+        inventory.execute("CREATE TRIGGER fail BEFORE UPDATE ON changes BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+        inventory.close()
+        with self.assertRaises(sqlite3.IntegrityError):
+            spkg.inventoryreplace([("ghost", "1.0", "pip")])
+
+        self.assertIsNone(spkg.inventoryget("ghost", []))
+        self.assertEqual(spkg.inventoryget("vim", []), "apt")
+        self.assertEqual(spkg.lookupinventory(spkg.spkgpath("inventory.bin"), "vim", spkg.inventorychanges()), "apt")
+
+    def test_names(self):
+        spkg.inventoryreplace([("vim", "9.0", "apt"), ("Requests", "2.31.0", "pip")])
+        self.assertEqual(open(spkg.spkgpath("names-installed.txt"), "r").read(), "Requests\nvim\n")
+
+        spkg.inventoryset({"htop": "apt"})
+        self.assertEqual(open(spkg.spkgpath("names-installed.txt"), "r").read(), "Requests\nvim\n")
+
+    def test_oldformat(self):
+        spkg.inventoryset({"htop": "apt"})
+        open(spkg.spkgpath("inventory.bin"), "wb").write(b"SPKGINV\x01" + bytes(10))
+
+        self.assertEqual(spkg.inventoryget("htop", []), "apt")
+
+
+    def test_concurrentmigration(self):
+        # Every SPKG started at the same time on an old inventory has to find it migrated exactly once
+        for version in (1, 2):
+            os.makedirs(os.path.dirname(spkg.spkgpath("inventory.db")), exist_ok=True)
+            if os.path.exists(spkg.spkgpath("inventory.db")):
+                os.remove(spkg.spkgpath("inventory.db"))
+            old = sqlite3.connect(spkg.spkgpath("inventory.db"))
+            old.execute("CREATE TABLE installed (name TEXT PRIMARY KEY, manager TEXT NOT NULL)")
+            if version == 2:
+                old.execute("ALTER TABLE installed ADD COLUMN version TEXT")
+            old.execute("INSERT INTO installed (name, manager) VALUES ('vim', 'apt')")
+            old.execute(f"PRAGMA user_version = {version}")
+            old.commit()
+            old.close()
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda n: spkg.openinventory().close(), range(8)))
+
+            self.assertEqual(spkg.inventorylisted(), {"apt": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
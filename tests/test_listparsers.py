@@ -0,0 +1,92 @@
+import contextlib
+import io
+import unittest
+
+from spkgtest import SpkgTestCase, fixture, spkg
+
+
+class ListParserTests(SpkgTestCase):
+    def test_dpkgquery(self):
+        # nano was removed and only kept its config files
+        self.assertEqual(spkg.getrecords("apt", fixture("listings", "dpkg-query.txt")), [
+            ("adduser", "3.134", "apt"),
+            ("libc6", "2.36-9+deb12u4", "apt"),
+            ("linux-image-amd64", "6.1.69-1", "apt"),
+            ("vim", "2:9.0.1378-2", "apt")
+        ])
+
+    def test_rpm(self):
+        expected = [("bash", "5.2.15-5.fc39"), ("kernel-core", "6.5.6-300.fc39"), ("perl-Text-Tabs+Wrap", "2023.0511-3.fc39")]
+        self.assertEqual(spkg.getrecords("dnf", fixture("listings", "rpm.txt")), [record + ("dnf",) for record in expected])
+        self.assertEqual(spkg.getrecords("zypper", fixture("listings", "rpm.txt")), [record + ("zypper",) for record in expected])
+
+    def test_pipjson(self):
+        self.assertEqual(spkg.getrecords("pip", fixture("listings", "pip.json")), [
+            ("pip", "24.0", "pip"),
+            ("requests", "2.31.0", "pip"),
+            ("zope.interface", "6.1", "pip")
+        ])
+
+    def test_npmtree(self):
+        self.assertEqual(spkg.getrecords("npm", fixture("listings", "npm-ls.json")), [
+            ("@angular/cli", "17.0.8", "npm"),
+            ("corepack", "0.23.0", "npm"),
+            ("npm", "10.2.4", "npm")
+        ])
+
+    def test_pacman(self):
+        self.assertEqual(spkg.getrecords("pacman", fixture("listings", "pacman-q.txt")), [
+            ("base", "3-2", "pacman"),
+            ("linux", "6.6.8.arch1-1", "pacman"),
+            ("python-pip", "23.3.1-1", "pacman")
+        ])
+
+    def test_flatpak(self):
+        self.assertEqual(spkg.getrecords("flatpak", fixture("listings", "flatpak.txt")), [
+            ("org.mozilla.firefox", "121.0", "flatpak"),
+            ("org.freedesktop.Platform", "23.08.10", "flatpak"),
+            ("com.valvesoftware.Steam", "", "flatpak")
+        ])
+
+    def test_chocolatey(self):
+        self.assertEqual(spkg.getrecords("chocolatey", fixture("listings", "choco.txt")), [
+            ("chocolatey", "2.2.2", "chocolatey"),
+            ("git", "2.43.0", "chocolatey"),
+            ("vscode", "1.85.1", "chocolatey")
+        ])
+
+    def test_cargo(self):
+        self.assertEqual(spkg.getrecords("cargo", fixture("listings", "cargo.txt")), [
+            ("bat", "0.24.0", "cargo"),
+            ("ripgrep", "14.0.3", "cargo"),
+            ("cargo-edit", "0.12.2", "cargo")
+        ])
+
+    def test_yarn(self):
+        self.assertEqual(spkg.getrecords("yarn", fixture("listings", "yarn.txt")), [
+            ("create-react-app", "5.0.1", "yarn"),
+            ("@vue/cli", "5.0.8", "yarn")
+        ])
+
+    def test_dumpavail(self):
+        self.assertEqual(spkg.parsedumpavail(fixture("listings", "apt-dumpavail.txt")), [
+            ("vim", "2:9.0.1378-2", "Vi IMproved - enhanced vi editor"),
+            ("htop", "3.2.2-2", "interactive processes viewer"),
+            ("libc6", "2.36-9+deb12u4", "")
+        ])
+
+    def test_emptyoutput(self):
+        self.assertEqual(spkg.getrecords("pip", ""), [])
+        self.assertEqual(spkg.getrecords("pip", "  \n"), [])
+
+    def test_badoutput(self):
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            self.assertEqual(spkg.getrecords("pip", "WARNING: pip is being invoked by an old script wrapper"), [])
+            self.assertEqual(spkg.getrecords("npm", '{"dependencies": ["not", "a", "dict"]}'), [])
+        self.assertIn("Error processing output for pip", printed.getvalue())
+        self.assertIn("Error processing output for npm", printed.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
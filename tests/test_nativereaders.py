@@ -0,0 +1,132 @@
+import os
+import sys
+import sysconfig
+import tempfile
+import unittest
+from unittest import mock
+
+from spkgtest import SpkgTestCase, fixture, fixtures, spkg
+
+
+trees = os.path.join(fixtures, "trees")
+
+
+class NativeReaderTests(SpkgTestCase):
+    def test_dpkg(self):
+        with mock.patch.object(spkg, "dpkgstatus", os.path.join(trees, "dpkg-status")):
+            self.assertEqual(spkg.readnative("apt"), [
+                ("adduser", "3.134", "apt"),
+                ("vim", "2:9.0.1378-2", "apt"),
+                ("libc6", "2.36-9+deb12u4", "apt"),
+                ("linux-image-amd64", "6.1.69-1", "apt")
+            ])
+
+            # dpkg-query.txt is what the listing command printed for the same status file
+            self.assertEqual(sorted(spkg.readnative("apt")), sorted(spkg.getrecords("apt", fixture("listings", "dpkg-query.txt"))))
+
+    def test_pacman(self):
+        with mock.patch.object(spkg, "pacmanlocal", os.path.join(trees, "pacman-local")):
+            self.assertEqual(sorted(spkg.readnative("pacman")), [
+                ("linux", "6.6.8.arch1-1", "pacman"),
+                ("python-pip", "23.3.1-1", "pacman")
+            ])
+
+    def test_pip(self):
+        # The same packages showing up again in a later directory count once, as in pip list
+        with mock.patch.object(spkg, "pippaths", lambda: [os.path.join(trees, "site-packages"), os.path.join(trees, "missing"), os.path.join(trees, "site-packages")]):
+            self.assertEqual(sorted(spkg.readnative("pip")), [
+                ("distro-info", "1.5", "pip"),
+                ("requests", "2.31.0", "pip"),
+                ("six", "1.16.0", "pip")
+            ])
+
+    def test_npm(self):
+        npm = os.path.join(trees, "npm", "bin", "npm")
+        with mock.patch.object(spkg.shutil, "which", lambda command: npm):
+            self.assertEqual(sorted(spkg.readnative("npm")), [
+                ("@angular/cli", "17.0.8", "npm"),
+                ("@vue/cli", "5.0.8", "npm"),
+                ("corepack", "0.23.0", "npm")
+            ])
+
+    def test_missing(self):
+        with mock.patch.object(spkg, "dpkgstatus", os.path.join(trees, "missing")), mock.patch.object(spkg, "pacmanlocal", os.path.join(trees, "missing")):
+            self.assertIsNone(spkg.readnative("apt"))
+            self.assertIsNone(spkg.readnative("pacman"))
+        with mock.patch.object(spkg.shutil, "which", lambda command: None):
+            self.assertIsNone(spkg.readnative("pip"))
+            self.assertIsNone(spkg.readnative("npm"))
+        self.assertIsNone(spkg.readnative("flatpak"))
+
+
+class ListedPathTests(SpkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.prefix = tempfile.TemporaryDirectory()
+        self.addCleanup(self.prefix.cleanup)
+        os.makedirs(os.path.join(self.prefix.name, "bin"))
+        os.makedirs(os.path.join(self.prefix.name, "lib", "python3.11", "site-packages"))
+        self.pip = os.path.join(self.prefix.name, "bin", "pip")
+
+    def which(self, shebang: str):
+        open(self.pip, "w").write(shebang + "\nimport sys\n")
+        return mock.patch.object(spkg.shutil, "which", lambda command: {"pip": self.pip, "python3": os.path.join(self.prefix.name, "bin", "python3")}.get(command))
+
+    def test_pipinterpreter(self):
+        with mock.patch.object(spkg.shutil, "which", lambda command: os.path.join(sysconfig.get_paths()["scripts"], "pip")):
+            self.assertEqual(spkg.pippaths(), spkg.ownsitepackages())
+        with self.which(f"#!{sys.executable}"):
+            self.assertEqual(spkg.pippaths(), spkg.ownsitepackages())
+
+        # Distributions add dist-packages and lib64 directories next to purelib, all of which pip list reports
+        with mock.patch.object(spkg.site, "getsitepackages", lambda: ["/usr/local/lib/python3/dist-packages", "/usr/lib/python3/dist-packages"]), mock.patch.object(spkg.site, "ENABLE_USER_SITE", False):
+            self.assertEqual(spkg.ownsitepackages(), ["/usr/local/lib/python3/dist-packages", "/usr/lib/python3/dist-packages"])
+
+    def test_pipprefix(self):
+        # Without a venv of its own the interpreter's layout is a guess, so pip list has to be run
+        with self.which(f"#!{self.prefix.name}/bin/python3.11"):
+            self.assertIsNone(spkg.pippaths())
+
+    def test_pipvenv(self):
+        sitepackages = os.path.realpath(os.path.join(self.prefix.name, "lib", "python3.11", "site-packages"))
+        open(os.path.join(self.prefix.name, "pyvenv.cfg"), "w").write("home = /usr/bin\ninclude-system-site-packages = false\n")
+        with self.which("#!/usr/bin/env python3"):
+            self.assertEqual(spkg.pippaths(), [sitepackages])
+
+        os.symlink("lib", os.path.join(self.prefix.name, "lib64"))
+        with self.which("#!/usr/bin/env python3"):
+            self.assertEqual(spkg.pippaths(), [sitepackages])
+
+        os.remove(os.path.join(self.prefix.name, "lib64"))
+        os.makedirs(os.path.join(self.prefix.name, "lib64", "python3.11", "site-packages"))
+        with self.which("#!/usr/bin/env python3"):
+            self.assertIsNone(spkg.pippaths())
+        os.rmdir(os.path.join(self.prefix.name, "lib64", "python3.11", "site-packages"))
+
+        open(os.path.join(self.prefix.name, "pyvenv.cfg"), "w").write("home = /usr/bin\ninclude-system-site-packages = true\n")
+        with self.which("#!/usr/bin/env python3"):
+            self.assertIsNone(spkg.pippaths())
+
+    def test_pipunknown(self):
+        with self.which("#!/bin/sh"):
+            self.assertIsNone(spkg.pippaths())
+            self.assertIsNone(spkg.fingerprint("pip"))
+        open(os.path.join(self.prefix.name, "pyvenv.cfg"), "w").write("home = /usr/bin\n")
+        os.makedirs(os.path.join(self.prefix.name, "lib", "python3.12", "site-packages"))
+        with self.which(f"#!{self.prefix.name}/bin/python3"):
+            self.assertIsNone(spkg.pippaths())
+        with mock.patch.object(spkg.shutil, "which", lambda command: None):
+            self.assertIsNone(spkg.pippaths())
+
+    def test_npm(self):
+        with mock.patch.object(spkg.shutil, "which", lambda command: os.path.join(trees, "npm", "bin", "npm")):
+            root = os.path.join(trees, "npm", "lib", "node_modules")
+            self.assertEqual(spkg.npmpaths(), [root, os.path.join(root, "@angular"), os.path.join(root, "@vue")])
+            self.assertEqual([stat[0] for stat in spkg.fingerprint("npm")], spkg.npmpaths())
+        with mock.patch.object(spkg.shutil, "which", lambda command: os.path.join(self.prefix.name, "bin", "npm")):
+            self.assertIsNone(spkg.npmpaths())
+            self.assertIsNone(spkg.fingerprint("npm"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import subprocess
+import unittest
+from unittest import mock
+
+from spkgtest import SpkgTestCase, spkg
+
+
+class OutdatedTests(SpkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.startpatches(mock.patch.object(spkg, "fingerprint", lambda manager: [[manager, 1, 1]]))
+
+    def outdated(self, outputs: dict):
+        def runconcurrently(commands, workers, timeout=None):
+            for i in commands:
+                yield i, None if outputs[i] is None else subprocess.CompletedProcess(commands[i], outputs[i][0], outputs[i][1], "")
+
+        with mock.patch.object(spkg, "runconcurrently", runconcurrently):
+            return spkg.outdatedpackages(list(outputs), False)
+
+    def test_exitcodes(self):
+        self.assertEqual(self.outdated({
+            "dnf": (100, "\nbash.x86_64    5.2.26-1.fc39    updates\n"),
+            "pacman": (1, "linux 6.6.8.arch1-1 -> 6.6.9.arch1-1\n"),
+            "npm": (1, '{"corepack": {"current": "0.23.0", "wanted": "0.24.0", "latest": "0.24.0"}}'),
+            "apt": (0, "Listing...\n")
+        }), {
+            "dnf": [("bash", "", "5.2.26-1.fc39")],
+            "pacman": [("linux", "6.6.8.arch1-1", "6.6.9.arch1-1")],
+            "npm": [("corepack", "0.23.0", "0.24.0")],
+            "apt": []
+        })
+
+    def test_uptodate(self):
+        self.assertEqual(self.outdated({"dnf": (0, ""), "pacman": (1, ""), "npm": (0, "")}), {"dnf": [], "pacman": [], "npm": []})
+
+    def test_failed(self):
+        self.assertEqual(self.outdated({"dnf": (1, ""), "pip": (2, "  \n"), "gem": None, "snap": (0, "")}), {"dnf": None, "pip": None, "gem": None, "snap": []})
+        self.assertEqual(sorted(spkg.readjson(spkg.spkgpath("outdated.json"))), ["snap"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import unittest
+from unittest import mock
+
+from spkgtest import SpkgTestCase, spkg
+
+
+class SearchLatencyTests(SpkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.startpatches(
+            mock.patch.dict(spkg.searchcommands, {"slow": "sleep 0.5; echo ", "quick": "echo "}),
+            mock.patch.object(spkg, "searchworkers", 1)
+        )
+        spkg.writeatomic(spkg.spkgpath("managers.json"), json.dumps({"packages": {}, "installed": ["slow", "quick"]}))
+
+    def test_ownduration(self):
+        # With one worker the quick search waits for the slow one, which mustn't count towards its latency
+        found = spkg.searchpackages(["vim", "htop"], lambda manager, package, result, source, packages: None)
+
+        self.assertEqual(found, {"vim": ["slow", "quick"], "htop": ["slow", "quick"]})
+        latency = spkg.loadranking()["latency"]
+        self.assertGreaterEqual(latency["slow"], 0.5)
+        self.assertLess(latency["quick"], 0.25)
+
+
+class SearchCacheTests(SpkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.startpatches(
+            mock.patch.dict(spkg.searchcommands, {"quick": "echo "}),
+            mock.patch.object(spkg, "cachesize", 2)
+        )
+        spkg.writeatomic(spkg.spkgpath("managers.json"), json.dumps({"packages": {}, "installed": ["quick"]}))
+
+    def test_leastrecentlyused(self):
+        for package in ("aaa", "bbb", "aaa", "ccc"):
+            spkg.searchpackages([package], lambda manager, package, result, source, packages: None)
+
+        self.assertEqual(list(spkg.loadsearchcache()), ["quick\naaa", "quick\nccc"])
+
+    def test_racehit(self):
+        for package in ("aaa", "bbb"):
+            spkg.searchpackages([package], lambda manager, package, result, source, packages: None)
+        with mock.patch("builtins.print"):
+            self.assertEqual(spkg.racepackage("aaa", ["quick"]), "quick")
+        spkg.searchpackages(["ccc"], lambda manager, package, result, source, packages: None)
+
+        self.assertEqual(list(spkg.loadsearchcache()), ["quick\naaa", "quick\nccc"])
+
+
+class OffersPackageTests(SpkgTestCase):
+    def test_exactname(self):
+        self.assertFalse(spkg.offerspackage("gem", "vi", "vim-flavor (1.0.0)\nvimrunner (0.3.4)\n"))
+        self.assertTrue(spkg.offerspackage("gem", "vimrunner", "vim-flavor (1.0.0)\nvimrunner (0.3.4)\n"))
+        self.assertFalse(spkg.offerspackage("gem", "vi", "ERROR:  Could not find a valid gem 'vi'\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
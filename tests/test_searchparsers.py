@@ -0,0 +1,111 @@
+import unittest
+
+from spkgtest import SpkgTestCase, fixture, spkg
+
+
+def parse(manager: str, name: str):
+    return spkg.searchparsers.get(manager, spkg.parsegenericsearch)(fixture("searches", name))
+
+
+class SearchParserTests(SpkgTestCase):
+    def test_apt(self):
+        self.assertEqual(parse("apt", "apt-search.txt"), [
+            ["neovim", "0.7.2-7", "heavily refactored vim fork"],
+            ["vim", "2:9.0.1378-2", "Vi IMproved - enhanced vi editor"],
+            ["vim-tiny", "2:9.0.1378-2", "Vi IMproved - enhanced vi editor - compact version"]
+        ])
+
+    def test_pacman(self):
+        self.assertEqual([record[:2] for record in parse("pacman", "pacman-ss.txt")], [["gvim", "9.0.2167-1"], ["vim", "9.0.2167-1"], ["vim-runtime", "9.0.2167-1"]])
+        self.assertEqual(parse("pacman", "pacman-ss.txt")[1][2], "Vi Improved, a highly configurable, improved version of the vi text editor")
+
+    def test_dnf(self):
+        # The architecture is cut off and the section headers are skipped
+        self.assertEqual(parse("dnf", "dnf-search.txt"), [
+            ["vim-enhanced", "", "A version of the VIM editor which includes recent enhancements"],
+            ["vim-common", "", "The common files needed by any version of the VIM editor"],
+            ["python3-pynvim", "", "Python client to Neovim"]
+        ])
+
+    def test_flatpak(self):
+        self.assertEqual(parse("flatpak", "flatpak-search.txt"), [
+            ["org.mozilla.firefox", "121.0", "Fast, Private & Safe Web Browser"],
+            ["org.mozilla.FirefoxDevEdition", "122.0b5", "Browser for developers"]
+        ])
+
+    def test_snap(self):
+        self.assertEqual(parse("snap", "snap-find.txt"), [
+            ["nvim", "v0.9.5", "Vim-fork focused on extensibility and usability"],
+            ["vim-editor", "9.0", "Vi IMproved - enhanced vi editor"]
+        ])
+
+    def test_npm(self):
+        self.assertEqual(parse("npm", "npm-search.txt"), [
+            ["vim", "0.0.1", "Vim bindings for the browser"],
+            ["vim-mode", "2.1.0", "A vim mode for editors"]
+        ])
+
+    def test_cargo(self):
+        self.assertEqual([record[:2] for record in parse("cargo", "cargo-search.txt")], [["ripgrep", "14.1.0"], ["ripgrep_all", "0.10.6"], ["grep-cli", "0.1.10"]])
+        self.assertEqual(parse("cargo", "cargo-search.txt")[2][2], "")
+
+    def test_generic(self):
+        self.assertEqual(parse("gem", "gem-search.txt"), [["vim-flavor", "4.0.2", ""], ["vimdoc", "0.0.3", ""], ["vimrunner", "0.3.4", ""]])
+        self.assertEqual(parse("homebrew", "brew-search.txt"), [["macvim", "", ""], ["neovim", "", ""], ["vim", "", ""], ["macvim-app", "", ""]])
+
+    def test_emptyoutput(self):
+        for manager in list(spkg.searchparsers) + ["gem"]:
+            self.assertEqual(spkg.searchparsers.get(manager, spkg.parsegenericsearch)(""), [])
+
+
+class RankingTests(SpkgTestCase):
+    def test_trigrams(self):
+        self.assertEqual(spkg.trigrams("Vim"), {"  v", " vi", "vim", "im "})
+        self.assertEqual(spkg.trigrams("vi"), {"  v", " vi", "vi "})
+
+    def test_editdistance(self):
+        self.assertEqual(spkg.editdistance("vim", "vim"), 0)
+        self.assertEqual(spkg.editdistance("kitten", "sitting"), 3)
+        self.assertEqual(spkg.editdistance("", "vim"), 3)
+        self.assertEqual(spkg.editdistance("vim", "ivm"), 2)
+
+    def test_order(self):
+        # Exact names first, then prefixes, then substrings, then the rest by edit distance, each tier ordered by edit distance
+        # and then by manager preference
+        records = [
+            ["vim-tiny", "", "", "apt"],
+            ["gvim", "", "", "pacman"],
+            ["vim", "", "", "npm"],
+            ["vm", "", "", "apt"],
+            ["neovim", "", "", "npm"],
+            ["vimx", "", "", "apt"],
+            ["vim", "", "", "snap"],
+            ["emacs", "", "", "apt"],
+            ["vi", "", "", "pacman"],
+            ["vimx", "", "", "pacman"],
+            ["vim", "", "", "apt"]
+        ]
+        ranked = spkg.rankrecords("Vim", records, ["pacman", "apt", "npm"], 20)
+        self.assertEqual([(record[0], record[3]) for record in ranked], [
+            ("vim", "apt"),
+            ("vim", "npm"),
+            ("vim", "snap"),
+            ("vimx", "pacman"),
+            ("vimx", "apt"),
+            ("vim-tiny", "apt"),
+            ("gvim", "pacman"),
+            ("neovim", "npm"),
+            ("vi", "pacman"),
+            ("vm", "apt")
+        ])
+        self.assertEqual(spkg.rankrecords("vim", records, ["pacman", "apt", "npm"], 2), ranked[:2])
+
+    def test_largeresults(self):
+        # Substring matches are kept even when many names share more trigrams with the query
+        records = [[f"vim-plugin-{n}", "", "", "npm"] for n in range(1000)] + [["neovim-qt", "", "", "apt"]]
+        self.assertEqual(spkg.rankrecords("vim-plugin-1", records, ["apt"], 3), [records[1], records[10], records[11]])
+        self.assertIn(records[-1], spkg.rankrecords("neovim", records, ["apt"], 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
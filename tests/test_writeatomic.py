@@ -0,0 +1,31 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from spkgtest import SpkgTestCase, spkg
+
+
+class WriteAtomicTests(SpkgTestCase):
+    def test_threads(self):
+        path = spkg.spkgpath("names-installed.txt")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda n: spkg.writeatomic(path, f"{n}\n" * 10000), range(64)))
+
+        self.assertIn(open(path, "r").read(), [f"{n}\n" * 10000 for n in range(64)])
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["names-installed.txt"])
+
+    def test_searchcache(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda n: spkg.updatesearchcache({f"apt\npackage{n}": {"time": n, "found": True, "records": []}}), range(64)))
+
+        self.assertEqual(sorted(spkg.loadsearchcache()), sorted(f"apt\npackage{n}" for n in range(64)))
+
+    def test_ranking(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda n: spkg.learnranking(installs=["apt"]), range(64)))
+
+        self.assertEqual(spkg.loadranking()["installs"], {"apt": 64})
+
+
+if __name__ == "__main__":
+    unittest.main()